@@ -1,11 +1,22 @@
 import os
-from bs4 import BeautifulSoup
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from html_backend import parse_html
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory
 import subprocess
 from flask_cors import CORS
 import sys
 from flask_cors import cross_origin
 from urllib.parse import quote as url_quote
+from concurrent.futures.process import BrokenProcessPool
+import worker_pool
+import jobs
+import instrumentation
+from edit_generated_site import (
+    EditError,
+    edit_site,
+    patch_site,
+    edit_generated_site as apply_site_edit,
+)
+from site_editor import document_cache, site_html_path
 
 if sys.version_info < (3, 8):
     required_python_version = ".".join(map(str, (3, 8)))
@@ -26,6 +37,8 @@ app = Flask(__name__)
 
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+job_manager = jobs.JobManager()
+
 @app.route('/generate_site', methods=['POST'])
 def generate_site():
     data = request.get_json()
@@ -35,14 +48,83 @@ def generate_site():
         title = data['title']
         template = data.get('template', '0')
         font = data.get('font', 'DMSans')
+        future = None
         try:
-            subprocess.check_output(['python3', 'generate_site.py', url, slug, title, template, font], stderr=subprocess.STDOUT, text=True)
+            future = worker_pool.submit_generation(url, slug, title, template, font)
+            future.result()
             return send_from_directory(app.static_folder, f'{slug}/index.html')
-        except subprocess.CalledProcessError as e:
-            return jsonify({"error": e.output, "request": request}), 500
+        except BrokenProcessPool as e:
+            if future is not None:
+                worker_pool.reset_executor(future.executor)
+            return jsonify({"error": f"Generation worker crashed: {e}"}), 500
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
     else:
         return jsonify({"error": "Missing parameters"}), 400
     
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    data = request.get_json()
+    if data is not None and 'url' in data and 'slug' in data and 'title' in data:
+        try:
+            job = job_manager.submit(
+                data['url'],
+                data['slug'],
+                data['title'],
+                data.get('template', '0'),
+                data.get('font', 'DMSans'),
+            )
+        except jobs.QueueFullError as e:
+            return jsonify({"error": str(e)}), 429, {"Retry-After": "30"}
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        status_url = f'/jobs/{job.id}'
+        return jsonify({
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": status_url,
+            "result_url": f'{status_url}/result',
+        }), 202, {"Location": status_url}
+    else:
+        return jsonify({"error": "Missing parameters"}), 400
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job.status == "failed":
+        return jsonify(job.to_dict()), 500
+    if job.status != "done":
+        return jsonify(job.to_dict()), 202, {"Location": f'/jobs/{job.id}'}
+    return send_from_directory(app.static_folder, f'{job.slug}/index.html')
+
+@app.route('/metrics/browser_pool', methods=['GET'])
+def browser_pool_metrics():
+    workers = {
+        str(pid): metrics["browser_pool"]
+        for pid, metrics in worker_pool.get_worker_metrics().items()
+        if "browser_pool" in metrics
+    }
+    totals = {}
+    for metrics in workers.values():
+        for key, value in metrics.items():
+            if key != "saturation":
+                totals[key] = totals.get(key, 0) + value
+    totals["saturation"] = totals["in_use"] / totals["size"] if totals.get("size") else 0
+    return jsonify({"workers": workers, "totals": totals})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(instrumentation.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/edit_generated_site', methods=['PUT'])
 @cross_origin(methods=['PUT'], headers=['Content-Type'])
 def edit_generated_site():
@@ -52,10 +134,34 @@ def edit_generated_site():
         template = data.get('template', '1')
         font = data.get('font', '0')
         try:
-            subprocess.check_output(['python3', 'edit_generated_site.py', slug, template, font], stderr=subprocess.STDOUT, text=True)
+            apply_site_edit(slug, template, font)
             return send_from_directory(app.static_folder, f'{slug}/index.html')
-        except subprocess.CalledProcessError as e:
-            return jsonify({"error": e.output, "request": request}), 500
+        except FileNotFoundError:
+            return jsonify({"error": "Site not found"}), 404
+        except EditError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    else:
+        return jsonify({"error": "Missing parameters"}), 400
+
+# Applies an ordered list of edit operations to a site at once, see
+# edit_generated_site.EDIT_OPERATIONS
+@app.route('/edit_site', methods=['PUT'])
+@cross_origin(methods=['PUT'], headers=['Content-Type'])
+def edit_site_batch():
+    data = request.get_json()
+    if data is not None and 'slug' in data and isinstance(data.get('operations'), list):
+        slug = data['slug']
+        try:
+            edit_site(slug, data['operations'])
+            return send_from_directory(app.static_folder, f'{slug}/index.html')
+        except FileNotFoundError:
+            return jsonify({"error": "Site not found"}), 404
+        except EditError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
     else:
         return jsonify({"error": "Missing parameters"}), 400
 
@@ -63,23 +169,37 @@ def edit_generated_site():
 @cross_origin(methods=['PUT'], headers=['Content-Type'])
 def edit_template():
     data = request.get_json()
-    if data is not None:
+    if data is not None and 'slug' in data:
         slug = data['slug']
-        html = data.get('html')
+        patches = data.get('patches')
         try:
-            soup = BeautifulSoup(html, 'html.parser')
-            file_path = os.path.join(app.static_folder, slug, 'index.html')
+            if patches is not None:
+                # Only the nodes changed in the editor, applied to the cached page
+                if not isinstance(patches, list):
+                    raise EditError("patches must be a list")
+                patch_site(slug, patches)
+                return jsonify({"slug": slug, "patched": len(patches)})
 
-            with open(file_path, 'w', encoding='utf-8') as file:
-                file.write(soup.prettify())
+            html_file_path = site_html_path(slug)
+            html = data.get('html')
+            if not isinstance(html, str):
+                raise EditError("html must be a string")
+            soup = parse_html(html)
+            # Written atomically and kept parsed for the next edits
+            document_cache.store(html_file_path, soup)
 
             return send_from_directory(app.static_folder, f'{slug}/index.html')
+        except FileNotFoundError:
+            return jsonify({"error": "Site not found"}), 404
+        except EditError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
-            return jsonify({"error": str(e), "request": request}), 500
+            return jsonify({"error": str(e)}), 500
     else:
-        return jsonify({"error": "Missing parameters"}, 400)
+        return jsonify({"error": "Missing parameters"}), 400
 
 if __name__ == '__main__':
+    worker_pool.warm_up()
     app.run(host='0.0.0.0', port=port)
 
 
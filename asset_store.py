@@ -0,0 +1,130 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+from atomic_files import write_atomic
+
+asset_store_dir = os.environ.get(
+    "ASSET_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "_objects"),
+)
+# Seconds between two sweeps of the store for objects no site links to
+# anymore, also the age an object needs before it can be removed
+asset_store_gc_interval = int(os.environ.get("ASSET_STORE_GC_INTERVAL", 3600))
+
+GC_MARKER_NAME = ".last-gc"
+
+
+# Function to mark a file as used now, creating it when missing
+def touch(path):
+    with open(path, "ab"):
+        pass
+    os.utime(path)
+
+
+# Stores every distinct asset body once, named by its sha256, so identical
+# files downloaded by different jobs share a single copy on disk
+class AssetStore:
+    def __init__(self, root=asset_store_dir):
+        self.root = root
+
+    def object_path(self, digest, extension):
+        return os.path.join(self.root, digest[:2], f"{digest}{extension}")
+
+    # Writes content into the store unless it is already there, returns its path
+    def put(self, content, extension):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.object_path(digest, extension)
+        try:
+            # Refreshes the age of a reused object, see collect_garbage()
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Concurrent writers never expose a half written object
+            write_atomic(path, content)
+        return path, digest
+
+    # Function to remove the objects (and image variants) that no site links
+    # to anymore: a hard link count of 1 means the store holds the only copy.
+    # Objects younger than min_age are kept, a running job may not have
+    # linked them yet (put() refreshes the age of reused objects).
+    def collect_garbage(self, min_age=asset_store_gc_interval):
+        removed = 0
+        cutoff = time.time() - min_age
+        for root, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename == GC_MARKER_NAME:
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_nlink == 1 and stat.st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    # Runs collect_garbage() when the last sweep of any worker is older than
+    # interval, returns the number of removed objects
+    def collect_garbage_if_due(self, interval=asset_store_gc_interval):
+        marker = os.path.join(self.root, GC_MARKER_NAME)
+        try:
+            if time.time() - os.path.getmtime(marker) < interval:
+                return 0
+        except OSError:
+            pass
+        os.makedirs(self.root, exist_ok=True)
+        touch(marker)
+        return self.collect_garbage(interval)
+
+    # Makes a stored object available at destination, hard linked when possible
+    def link(self, path, destination):
+        if os.path.exists(destination):
+            return
+        try:
+            os.link(path, destination)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(path, destination)
+
+
+# The assets of one generated site. Repeated URLs resolve to the first
+# download and identical bodies end up in the same content named file.
+# Every linked file is recorded in manifest (a SiteManifest) when given.
+class JobAssets:
+    def __init__(self, assets_dir, assets_base_url, store=None, manifest=None):
+        self.assets_dir = assets_dir
+        self.assets_base_url = assets_base_url
+        self.store = store or AssetStore()
+        self.manifest = manifest
+        self._urls = {}
+        self._lock = threading.Lock()
+
+    # Public URL of an asset already saved for this source URL, or None
+    def lookup(self, source_url):
+        with self._lock:
+            return self._urls.get(source_url)
+
+    # Saves content for source_url and returns its public URL
+    def save(self, source_url, content, extension):
+        path, digest = self.store.put(content, extension)
+        filename = f"{digest[:16]}{extension}"
+        self.store.link(path, os.path.join(self.assets_dir, filename))
+        new_url = f"{self.assets_base_url}/{filename}"
+        with self._lock:
+            self._urls[source_url] = new_url
+        if self.manifest is not None:
+            self.manifest.record(source_url, f"assets/{filename}", digest)
+        return new_url
+
+    # Links a file of the store (an image variant) into the assets folder
+    # under its own name, returns its public URL
+    def link(self, path):
+        filename = os.path.basename(path)
+        self.store.link(path, os.path.join(self.assets_dir, filename))
+        if self.manifest is not None:
+            self.manifest.record(None, f"assets/{filename}")
+        return f"{self.assets_base_url}/{filename}"
@@ -0,0 +1,30 @@
+import os
+import uuid
+from contextlib import contextmanager
+
+
+# Yields a temporary path next to path to write the new content to; once
+# the block is done it replaces path in one rename, so readers see either
+# the old or the new file and never a partial one. The temporary file is
+# removed when the block fails.
+@contextmanager
+def atomic_path(path):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Function to write text or bytes to path with an atomic replace
+def write_atomic(path, data):
+    with atomic_path(path) as tmp_path:
+        if isinstance(data, str):
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                file.write(data)
+        else:
+            with open(tmp_path, "wb") as file:
+                file.write(data)
@@ -0,0 +1,102 @@
+# Compares the color extraction of colors.extract_palettes with the three
+# full KMeans fits generate_site.py used to run per screenshot.
+#
+# Usage:
+#     python3 benchmarks/bench_colors.py screenshot.png [more.png ...] [--repeat 3]
+#
+# Screenshots can be taken from any generated site: static/{slug}/screenshot.png
+import os
+import sys
+import time
+import argparse
+import statistics
+import numpy as np
+from PIL import Image
+from sklearn.cluster import KMeans
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from colors import extract_palettes  # noqa: E402
+
+
+# The implementation extract_colors_from_website used before. Only changes:
+# RGBA conversion so that RGB screenshots reshape correctly, and n_init
+# pinned to 10, the default of the scikit-learn version in requirements.txt
+def legacy_extract_colors_from_resized(image, n_colors, max_size=1900):
+    aspect_ratio = image.width / image.height
+    if image.width > image.height:
+        new_width = max_size
+        new_height = int(max_size / aspect_ratio)
+    else:
+        new_height = max_size
+        new_width = int(max_size * aspect_ratio)
+    resized_image = image.resize((new_width, new_height))
+    pixels = np.array(resized_image.convert("RGBA")).reshape(-1, 4)
+    if np.all(pixels[:, 3] == 255):
+        pixels = pixels[:, :3]
+    kmeans = KMeans(n_clusters=n_colors, n_init=10)
+    kmeans.fit(pixels)
+    return kmeans.cluster_centers_.round(0).astype(int)
+
+
+def legacy_extract_palettes(image):
+    header = legacy_extract_colors_from_resized(
+        image.crop((0, 0, image.width, int(image.height * 0.05))), 2
+    )
+    background = legacy_extract_colors_from_resized(image, 1)
+    palette = legacy_extract_colors_from_resized(image, 4)
+    return header, background, palette
+
+
+def to_hex(colors):
+    return ["#{:02x}{:02x}{:02x}".format(*color[:3]) for color in colors]
+
+
+def measure(function, image, repeat):
+    durations = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(image)
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations), result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark screenshot color extraction"
+    )
+    parser.add_argument("screenshots", nargs="+")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    print(f"{'screenshot':<40} {'size':>11} {'legacy ms':>10} {'new ms':>8} {'speedup':>8}")
+    for path in args.screenshots:
+        image = Image.open(path)
+        image.load()
+
+        new_seconds, new_result = measure(extract_palettes, image, args.repeat)
+        if args.skip_legacy:
+            legacy_seconds, legacy_result = float("nan"), None
+        else:
+            legacy_seconds, legacy_result = measure(
+                legacy_extract_palettes, image, args.repeat
+            )
+
+        size = f"{image.width}x{image.height}"
+        print(
+            f"{os.path.basename(path)[:40]:<40} {size:>11} "
+            f"{legacy_seconds * 1000:>10.1f} {new_seconds * 1000:>8.1f} "
+            f"{legacy_seconds / new_seconds:>7.1f}x"
+        )
+        for name, colors in zip(("header", "background", "palette"), new_result):
+            line = f"    {name:<10} new {to_hex(colors)}"
+            if legacy_result is not None:
+                index = ("header", "background", "palette").index(name)
+                line += f"  legacy {to_hex(legacy_result[index])}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Compares HTML parser backends on a corpus of saved pages: parse time,
+# serialize time (compact and prettify) and peak memory. Each backend runs
+# in a fresh process so its peak RSS is not inflated by the ones before.
+#
+# Usage:
+#     python3 benchmarks/bench_parsers.py static/*/index.html [--repeat 5]
+#
+# The BeautifulSoup backends (lxml, html5lib, html.parser) are the ones the
+# pipeline can use through HTML_PARSER. selectolax and lexbor are measured
+# as a reference for raw parse/serialize speed without the BeautifulSoup tree.
+import os
+import sys
+import time
+import argparse
+import resource
+import statistics
+import importlib.util
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_backend import PARSER_BACKENDS, is_backend_available  # noqa: E402
+
+REFERENCE_BACKENDS = {"selectolax": "selectolax", "lexbor": "selectolax"}
+
+
+def reference_parser(backend):
+    if backend == "lexbor":
+        from selectolax.lexbor import LexborHTMLParser
+
+        return LexborHTMLParser
+    from selectolax.parser import HTMLParser
+
+    return HTMLParser
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def median_ms(function, repeat):
+    durations = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations) * 1000, result
+
+
+# Runs in a fresh process: measures every page with one backend
+def measure_backend(backend, paths, repeat):
+    pages = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="replace") as file:
+            pages.append(file.read())
+
+    if backend in REFERENCE_BACKENDS:
+        parser = reference_parser(backend)
+
+        def parse(html):
+            return parser(html)
+
+        def serialize(tree):
+            return tree.html
+
+        prettify = None
+    else:
+        from html_backend import parse_html, serialize_html
+
+        def parse(html):
+            return parse_html(html, backend)
+
+        def serialize(tree):
+            return serialize_html(tree, pretty=False)
+
+        def prettify(tree):
+            return serialize_html(tree, pretty=True)
+
+    baseline_mb = peak_rss_mb()
+    totals = {"parse": 0.0, "serialize": 0.0, "prettify": 0.0}
+    for html in pages:
+        parse_ms, tree = median_ms(lambda: parse(html), repeat)
+        serialize_ms, _ = median_ms(lambda: serialize(tree), repeat)
+        totals["parse"] += parse_ms
+        totals["serialize"] += serialize_ms
+        if prettify is not None:
+            prettify_ms, _ = median_ms(lambda: prettify(tree), repeat)
+            totals["prettify"] += prettify_ms
+        else:
+            totals["prettify"] = float("nan")
+        del tree
+    totals["peak_mb"] = peak_rss_mb() - baseline_mb
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML parser backends")
+    parser.add_argument("pages", nargs="+")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--backends",
+        default=",".join(list(PARSER_BACKENDS) + list(REFERENCE_BACKENDS)),
+        help="comma separated backends to measure",
+    )
+    args = parser.parse_args()
+
+    size_mb = sum(os.path.getsize(path) for path in args.pages) / (1024 * 1024)
+    print(f"{len(args.pages)} pages, {size_mb:.1f} MB, median of {args.repeat} runs")
+    print(
+        f"{'backend':<12} {'parse ms':>10} {'serialize ms':>13} "
+        f"{'prettify ms':>12} {'peak MB':>8}"
+    )
+
+    context = multiprocessing.get_context("spawn")
+    for backend in args.backends.split(","):
+        if backend in REFERENCE_BACKENDS:
+            available = importlib.util.find_spec(REFERENCE_BACKENDS[backend]) is not None
+        else:
+            available = is_backend_available(backend)
+        if not available:
+            print(f"{backend:<12} not installed")
+            continue
+
+        with context.Pool(1) as pool:
+            totals = pool.apply(measure_backend, (backend, args.pages, args.repeat))
+        print(
+            f"{backend:<12} {totals['parse']:>10.1f} {totals['serialize']:>13.1f} "
+            f"{totals['prettify']:>12.1f} {totals['peak_mb']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# End to end benchmark of the generation pipeline on the frozen corpus of
+# benchmarks/corpus.py, served from a local HTTP server so that runs do not
+# depend on live sites.
+#
+# Usage:
+#     python3 benchmarks/bench_pipeline.py [--pages example,...] [--repeat 3]
+#     python3 benchmarks/bench_pipeline.py --save-baseline
+#
+# Scenarios, each run in a fresh process:
+#     template0 - generate_site with template "0" (scrape_data_from_url)
+#     template1 - generate_site with template "1" (capture, colors, logo)
+#     colors    - color extraction on the recorded screenshot
+#     edit      - PUT /edit_generated_site and /edit_template on a template "1"
+#                 site generated first; only the edits are timed, its network
+#                 bytes are those of the generation
+#
+# Reported per scenario: wall time, peak RSS of the Python process and of
+# the largest browser process, bytes served by the corpus server, and the
+# time spent per pipeline stage (from the job spans). Results are compared
+# with benchmarks/baseline.json, the run fails when a metric regressed by
+# more than --tolerance.
+#
+# Neither the corpus nor the baseline is committed: recorded pages belong
+# to third parties and timings depend on the machine. Record the corpus
+# with benchmarks/corpus.py and save a baseline with --save-baseline on the
+# machine that runs the comparisons.
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from corpus import (  # noqa: E402
+    CORPUS_DIR,
+    SCREENSHOT_NAME,
+    CorpusServer,
+    corpus_pages,
+    load_manifest,
+)
+
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+SCENARIOS = ("template0", "template1", "colors", "edit")
+# Metrics compared with the baseline, lower is better for all of them
+COMPARED_METRICS = ("wall_s", "peak_rss_mb", "network_bytes")
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def stage_breakdown(spans):
+    stages = {}
+    fetched = {}
+    for span in spans:
+        if span["kind"] == "asset_fetch":
+            status = span.get("cache_status", "error")
+            fetched[status] = fetched.get(status, 0) + span.get("bytes", 0)
+        else:
+            stages[span["name"]] = stages.get(span["name"], 0) + span["duration_ms"]
+    return stages, fetched
+
+
+# Runs in a fresh process with the repository as working directory
+def run_scenario(scenario, page_url, screenshot_path, work_dir):
+    os.chdir(REPO_DIR)
+    sys.path.insert(0, REPO_DIR)
+    # Start every run cold and keep the benchmark out of the shared folders
+    os.environ["ASSET_STORE_DIR"] = os.path.join(work_dir, "objects")
+    os.environ["HTTP_CACHE_DIR"] = os.path.join(work_dir, "http")
+    os.environ["TRACE_LOG_PATH"] = ""
+    os.environ.setdefault("BASE_URL", "http://127.0.0.1:8080")
+
+    import instrumentation
+
+    slug = f"benchmark-{os.getpid()}"
+    result = {}
+    try:
+        if scenario == "colors":
+            from PIL import Image
+            from colors import extract_palettes
+
+            image = Image.open(screenshot_path)
+            image.load()
+            baseline_mb = peak_rss_mb()
+            started = time.perf_counter()
+            extract_palettes(image)
+            result["wall_s"] = time.perf_counter() - started
+            result["peak_rss_mb"] = peak_rss_mb() - baseline_mb
+            return result
+
+        import generate_site
+        from browser_pool import get_browser_pool
+
+        template = "0" if scenario == "template0" else "1"
+        baseline_mb = peak_rss_mb()
+        trace = instrumentation.start_trace(scenario)
+        started = time.perf_counter()
+        generate_site.generate_site(page_url, slug, "Benchmark", template, "DMSans")
+        elapsed = time.perf_counter() - started
+        instrumentation.end_trace()
+
+        if scenario == "edit":
+            from app import app
+
+            client = app.test_client()
+            html_path = os.path.join(REPO_DIR, "static", slug, "index.html")
+            with open(html_path, "r", encoding="utf-8") as file:
+                html = file.read()
+            trace = instrumentation.start_trace(scenario)
+            baseline_mb = peak_rss_mb()
+            started = time.perf_counter()
+            with instrumentation.span("edit_generated_site"):
+                client.put(
+                    "/edit_generated_site",
+                    json={"slug": slug, "template": "1", "font": "0"},
+                )
+            with instrumentation.span("edit_template"):
+                client.put("/edit_template", json={"slug": slug, "html": html})
+            elapsed = time.perf_counter() - started
+            instrumentation.end_trace()
+
+        result["wall_s"] = elapsed
+        result["peak_rss_mb"] = peak_rss_mb() - baseline_mb
+        result["stages_ms"], result["fetched_bytes"] = stage_breakdown(trace.spans)
+        # Browser processes count once they exited
+        get_browser_pool().close()
+        result["browser_peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+        return result
+    finally:
+        shutil.rmtree(os.path.join(REPO_DIR, "static", slug), ignore_errors=True)
+
+
+def measure(context, server, scenario, page_url, screenshot_path, repeat):
+    runs = []
+    for _ in range(repeat):
+        work_dir = tempfile.mkdtemp(prefix="bench-pipeline-")
+        server.reset_counters()
+        try:
+            # Not a multiprocessing.Pool: its workers are daemonic and can not
+            # start the image optimizer's process pool
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                run = executor.submit(
+                    run_scenario, scenario, page_url, screenshot_path, work_dir
+                ).result()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        run["network_bytes"] = server.bytes_sent
+        runs.append(run)
+
+    # Median of every numeric metric, stage times included
+    result = {}
+    for key in runs[0]:
+        if isinstance(runs[0][key], dict):
+            names = set().union(*(run.get(key, {}) for run in runs))
+            result[key] = {
+                name: statistics.median(run.get(key, {}).get(name, 0) for run in runs)
+                for name in sorted(names)
+            }
+        else:
+            result[key] = statistics.median(run[key] for run in runs)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for page, scenarios in results.items():
+        for scenario, metrics in scenarios.items():
+            reference = baseline.get(page, {}).get(scenario)
+            if not reference:
+                continue
+            for metric in COMPARED_METRICS:
+                if metric not in metrics or not reference.get(metric):
+                    continue
+                change = metrics[metric] / reference[metric] - 1
+                metrics.setdefault("change", {})[metric] = change
+                if change > tolerance:
+                    regressions.append((page, scenario, metric, change))
+    return regressions
+
+
+def print_results(results):
+    print(
+        f"{'page':<20} {'scenario':<10} {'wall s':>8} {'rss MB':>8} "
+        f"{'browser MB':>11} {'net KB':>9}  change vs baseline"
+    )
+    for page, scenarios in results.items():
+        for scenario, metrics in scenarios.items():
+            changes = ", ".join(
+                f"{metric} {change:+.0%}"
+                for metric, change in metrics.get("change", {}).items()
+            )
+            print(
+                f"{page[:20]:<20} {scenario:<10} {metrics['wall_s']:>8.2f} "
+                f"{metrics['peak_rss_mb']:>8.1f} "
+                f"{metrics.get('browser_peak_rss_mb', 0):>11.1f} "
+                f"{metrics.get('network_bytes', 0) / 1024:>9.1f}  {changes}"
+            )
+            stages = metrics.get("stages_ms", {})
+            if stages:
+                print(
+                    "    stages ms: "
+                    + ", ".join(f"{name} {ms:.0f}" for name, ms in stages.items())
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline")
+    parser.add_argument("--corpus", default=CORPUS_DIR)
+    parser.add_argument("--pages", help="comma separated page names, all by default")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.15, help="allowed slowdown, 0.15 = 15%%"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    pages = corpus_pages(args.corpus)
+    if args.pages:
+        selected = set(args.pages.split(","))
+        pages = [(name, page_dir) for name, page_dir in pages if name in selected]
+    if not pages:
+        sys.exit(f"No recorded pages in {args.corpus}, see benchmarks/corpus.py")
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    with CorpusServer(args.corpus) as server:
+        for name, page_dir in pages:
+            page_url = server.page_url(load_manifest(page_dir))
+            screenshot_path = os.path.join(page_dir, SCREENSHOT_NAME)
+            for scenario in args.scenarios.split(","):
+                results.setdefault(name, {})[scenario] = measure(
+                    context, server, scenario, page_url, screenshot_path, args.repeat
+                )
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+    elif not args.save_baseline:
+        print(f"No baseline at {args.baseline}, save one with --save-baseline")
+    regressions = compare(results, baseline, args.tolerance)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if args.save_baseline:
+        for page, scenarios in results.items():
+            for scenario, metrics in scenarios.items():
+                metrics.pop("change", None)
+                baseline.setdefault(page, {})[scenario] = metrics
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        for page, scenario, metric, change in regressions:
+            print(f"REGRESSION {page} {scenario} {metric} {change:+.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# Frozen corpus of captured pages for the pipeline benchmark, and the local
+# HTTP server that replays it.
+#
+# Recording a page (needs network access and Playwright):
+#     python3 benchmarks/corpus.py record https://example.com example
+#
+# Serving the corpus by hand, e.g. to look at a recorded page:
+#     python3 benchmarks/corpus.py serve --port 8765
+#
+# Every recorded URL scheme://host/path?query is stored under the local path
+# /host/path (the query becomes part of the file name), and absolute URLs in
+# the HTML and CSS are rewritten to those paths. Served from the corpus
+# server, a page then resolves every asset, relative or absolute, locally.
+import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+MANIFEST_NAME = "manifest.json"
+SCREENSHOT_NAME = "screenshot.png"
+REWRITTEN_CONTENT_TYPES = ("text/html", "text/css")
+
+
+# Function to map a recorded URL to its path on the corpus server
+def local_path(url):
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if path.endswith("/"):
+        path += "index.html"
+    if parts.query:
+        digest = hashlib.sha256(parts.query.encode("utf-8")).hexdigest()[:12]
+        root, extension = os.path.splitext(path)
+        path = f"{root}__{digest}{extension}"
+    return f"/{parts.hostname}{path}"
+
+
+def _rewrite_urls(text, urls):
+    # Longest first, so that no URL is replaced inside a longer one
+    for url in sorted(urls, key=len, reverse=True):
+        path = local_path(url)
+        text = text.replace(url, path)
+        text = text.replace(url.split(":", 1)[1], path)
+    return text
+
+
+# Function to capture a live page with the pipeline's own capture and store
+# its HTML, screenshot and every recorded asset under corpus_dir/name
+def record_page(url, name, corpus_dir=CORPUS_DIR):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from capture import capture_page
+
+    capture = capture_page(url, remove_cookie_banners=True)
+    page_dir = os.path.join(corpus_dir, name)
+    os.makedirs(page_dir, exist_ok=True)
+
+    recorded = capture.responses.responses()
+    urls = [response.url for response in recorded] + [url]
+    files = {}
+
+    def store(source_url, body, content_type):
+        path = local_path(source_url)
+        if content_type.split(";")[0].strip() in REWRITTEN_CONTENT_TYPES:
+            body = _rewrite_urls(body.decode("utf-8", errors="replace"), urls).encode(
+                "utf-8"
+            )
+        file_name = os.path.join("files", path.lstrip("/"))
+        file_path = os.path.join(page_dir, file_name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as file:
+            file.write(body)
+        files[path] = {"file": file_name, "content_type": content_type}
+
+    for response in recorded:
+        headers = {key.lower(): value for key, value in response.headers.items()}
+        store(
+            response.url,
+            response.body,
+            headers.get("content-type", "application/octet-stream"),
+        )
+    store(url, capture.html.encode("utf-8"), "text/html; charset=utf-8")
+
+    with open(os.path.join(page_dir, SCREENSHOT_NAME), "wb") as file:
+        file.write(capture.viewport_screenshot)
+    manifest = {
+        "url": url,
+        "host": urlparse(url).hostname,
+        "page_path": local_path(url),
+        "files": files,
+    }
+    with open(os.path.join(page_dir, MANIFEST_NAME), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def load_manifest(page_dir):
+    with open(os.path.join(page_dir, MANIFEST_NAME), "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+# Function to list the recorded pages of a corpus as (name, page_dir)
+def corpus_pages(corpus_dir=CORPUS_DIR):
+    if not os.path.isdir(corpus_dir):
+        return []
+    return [
+        (name, os.path.join(corpus_dir, name))
+        for name in sorted(os.listdir(corpus_dir))
+        if os.path.exists(os.path.join(corpus_dir, name, MANIFEST_NAME))
+    ]
+
+
+# Local stand-in for the recorded sites. Serves every page of the corpus
+# and counts the bytes it sends, which is the network traffic of a run.
+class CorpusServer:
+    def __init__(self, corpus_dir=CORPUS_DIR, port=0):
+        self.routes = {}
+        # Root relative URLs of a page lose their host, they fall back to
+        # the host of the page that was requested last
+        self.default_host = None
+        for _, page_dir in corpus_pages(corpus_dir):
+            for path, entry in load_manifest(page_dir)["files"].items():
+                self.routes[path] = (
+                    os.path.join(page_dir, entry["file"]),
+                    entry["content_type"],
+                )
+        self.bytes_sent = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    # Public URL of a recorded page on this server
+    def page_url(self, manifest):
+        return f"http://127.0.0.1:{self.port}{manifest['page_path']}"
+
+    def reset_counters(self):
+        with self._lock:
+            self.bytes_sent = 0
+            self.requests = 0
+
+    # Finds the recorded file of a request path with the same mapping that
+    # was used at record time: the first path segment is the original host
+    def _lookup(self, request_path):
+        url = "http:/" + request_path
+        route = self.routes.get(local_path(url))
+        if route is not None:
+            self.default_host = urlsplit(url).hostname
+            return route
+        if self.default_host:
+            return self.routes.get(local_path(f"http://{self.default_host}{request_path}"))
+        return None
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                route = server._lookup(self.path)
+                if route is None:
+                    self.send_error(404)
+                    return
+                file_path, content_type = route
+                with open(file_path, "rb") as file:
+                    body = file.read()
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", "no-store")
+                self.end_headers()
+                self.wfile.write(body)
+                with server._lock:
+                    server.bytes_sent += len(body)
+                    server.requests += 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or serve the benchmark corpus")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record = subparsers.add_parser("record", help="capture a live page into the corpus")
+    record.add_argument("url")
+    record.add_argument("name")
+    serve = subparsers.add_parser("serve", help="serve the corpus")
+    serve.add_argument("--port", type=int, default=8765)
+    for subparser in (record, serve):
+        subparser.add_argument("--corpus", default=CORPUS_DIR)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        manifest = record_page(args.url, args.name, args.corpus)
+        print(f"Recorded {len(manifest['files'])} files of {args.url}")
+    else:
+        with CorpusServer(args.corpus, args.port) as server:
+            for name, page_dir in corpus_pages(args.corpus):
+                print(f"{name:<30} {server.page_url(load_manifest(page_dir))}")
+            threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
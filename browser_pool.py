@@ -0,0 +1,229 @@
+import os
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from playwright.sync_api import sync_playwright
+
+browser_pool_size = int(os.environ.get("BROWSER_POOL_SIZE", 1))
+browser_max_pages = int(os.environ.get("BROWSER_MAX_PAGES", 50))
+browser_max_memory_mb = int(os.environ.get("BROWSER_MAX_MEMORY_MB", 1024))
+
+_local = threading.local()
+_pools = []
+_pools_lock = threading.Lock()
+_metrics_listener = None
+
+
+# Function to read the resident memory of a process from /proc (Linux only)
+def _process_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+class PooledBrowser:
+    def __init__(self, browser, temporary=False):
+        self.browser = browser
+        self.temporary = temporary
+        self.pages_served = 0
+        self.launched_at = time.time()
+
+    # Total RSS of the browser and its renderer/GPU processes, None if unknown
+    def memory_mb(self):
+        try:
+            session = self.browser.new_browser_cdp_session()
+            try:
+                info = session.send("SystemInfo.getProcessInfo")
+            finally:
+                session.detach()
+        except Exception:
+            return None
+        pids = [process["id"] for process in info.get("processInfo", [])]
+        if not pids:
+            return None
+        return sum(_process_rss_mb(pid) for pid in pids)
+
+
+# Keeps up to `size` warm Chromium browsers and hands out an isolated
+# BrowserContext per job. Browsers are recycled once they have served
+# `max_pages` contexts or grown past `max_memory_mb`.
+#
+# Playwright's sync API is bound to the thread that started it, so a pool
+# must only be used from the thread that created it, see get_browser_pool().
+class BrowserPool:
+    def __init__(
+        self,
+        size=browser_pool_size,
+        max_pages=browser_max_pages,
+        max_memory_mb=browser_max_memory_mb,
+        launch_options=None,
+    ):
+        self.size = max(1, size)
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.launch_options = launch_options or {"headless": True}
+        self._playwright = None
+        self._idle = []
+        self._in_use = 0
+        self._stats = {
+            "launches": 0,
+            "launch_seconds_total": 0.0,
+            "contexts_served": 0,
+            "overflow_launches": 0,
+            "recycled_page_limit": 0,
+            "recycled_memory_limit": 0,
+            "peak_in_use": 0,
+        }
+
+    def _launch(self, temporary=False):
+        if self._playwright is None:
+            self._playwright = sync_playwright().start()
+        started = time.time()
+        browser = self._playwright.chromium.launch(**self.launch_options)
+        self._stats["launches"] += 1
+        self._stats["launch_seconds_total"] += time.time() - started
+        return PooledBrowser(browser, temporary=temporary)
+
+    def _acquire(self):
+        while self._idle:
+            pooled = self._idle.pop()
+            if pooled.browser.is_connected():
+                break
+        else:
+            pooled = None
+
+        if pooled is None:
+            # All warm browsers are busy: launch a throwaway one instead of
+            # waiting, since only this thread could ever release them
+            temporary = self._in_use >= self.size
+            if temporary:
+                self._stats["overflow_launches"] += 1
+            pooled = self._launch(temporary=temporary)
+
+        self._in_use += 1
+        self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._in_use)
+        return pooled
+
+    def _release(self, pooled):
+        self._in_use -= 1
+        if pooled.temporary or not pooled.browser.is_connected():
+            self._close_browser(pooled)
+            return
+        if pooled.pages_served >= self.max_pages:
+            self._stats["recycled_page_limit"] += 1
+            self._close_browser(pooled)
+            return
+        memory = pooled.memory_mb()
+        if memory is not None and memory > self.max_memory_mb:
+            self._stats["recycled_memory_limit"] += 1
+            self._close_browser(pooled)
+            return
+        self._idle.append(pooled)
+
+    def _close_browser(self, pooled):
+        try:
+            pooled.browser.close()
+        except Exception:
+            pass
+
+    # Context manager yielding a fresh BrowserContext on a warm browser. The
+    # pool metrics are published once the browser is taken and once it is
+    # back, so the browser in use by a running job shows up in them.
+    @contextmanager
+    def new_context(self, **context_options):
+        pooled = self._acquire()
+        _publish_metrics()
+        context = None
+        try:
+            context = pooled.browser.new_context(**context_options)
+            yield context
+        finally:
+            if context is not None:
+                pooled.pages_served += 1
+                self._stats["contexts_served"] += 1
+                try:
+                    context.close()
+                except Exception:
+                    pass
+            self._release(pooled)
+            _publish_metrics()
+
+    def metrics(self):
+        return {
+            "size": self.size,
+            "in_use": self._in_use,
+            "idle": len(self._idle),
+            "saturation": self._in_use / self.size,
+            **self._stats,
+        }
+
+    def close(self):
+        for pooled in self._idle:
+            self._close_browser(pooled)
+        self._idle = []
+        if self._playwright is not None:
+            try:
+                self._playwright.stop()
+            except Exception:
+                pass
+            self._playwright = None
+
+
+# Function to get the browser pool of the current thread
+def get_browser_pool():
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        pool = BrowserPool()
+        _local.pool = pool
+        with _pools_lock:
+            _pools.append(pool)
+    return pool
+
+
+# Function to sum up the metrics of every browser pool in this process
+def pool_metrics():
+    with _pools_lock:
+        pools = list(_pools)
+    totals = {"pools": len(pools)}
+    for pool in pools:
+        for key, value in pool.metrics().items():
+            if key == "saturation":
+                continue
+            totals[key] = totals.get(key, 0) + value
+    size = totals.get("size", 0)
+    totals["saturation"] = totals.get("in_use", 0) / size if size else 0
+    return totals
+
+
+# Function to register a callback(metrics) receiving pool_metrics() whenever
+# a browser of this process is taken or given back
+def set_metrics_listener(listener):
+    global _metrics_listener
+    _metrics_listener = listener
+
+
+def _publish_metrics():
+    listener = _metrics_listener
+    if listener is None:
+        return
+    try:
+        listener(pool_metrics())
+    except Exception as e:
+        print(f"[ERROR] Browser pool metrics listener failed: {e}")
+
+
+@atexit.register
+def _close_pools():
+    with _pools_lock:
+        pools = list(_pools)
+    for pool in pools:
+        try:
+            pool.close()
+        except Exception:
+            pass
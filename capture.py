@@ -0,0 +1,313 @@
+import os
+import time
+from browser_pool import get_browser_pool
+from instrumentation import span
+from routing import RequestRouter, request_blocking_enabled
+from response_store import ResponseStore
+
+VIEWPORT = {"width": 1920, "height": 1080}
+
+# Overall time allowed for loading lazy content of a page, in seconds
+scroll_time_budget = float(os.environ.get("SCROLL_TIME_BUDGET", 10))
+# How long the DOM and the network must stay quiet to count as stable, in ms
+stable_quiet_ms = int(os.environ.get("STABLE_QUIET_MS", 500))
+# Longest wait for the page to settle after each scroll step, in seconds, so
+# pages that never stop changing (carousels, tickers) still get scrolled
+scroll_step_timeout = float(os.environ.get("SCROLL_STEP_TIMEOUT", 1.5))
+# Requests open for longer than this (long polling, streams) are ignored
+LONG_REQUEST_SECONDS = 5
+POLL_INTERVAL_MS = 100
+
+# Installed before any page script runs: remembers when elements were last
+# added or removed. Attribute changes are ignored, animations make them
+# all the time.
+DOM_ACTIVITY_SCRIPT = """
+(() => {
+    const activity = {lastMutation: performance.now()};
+    window.__captureActivity = activity;
+    const observe = () => new MutationObserver(() => {
+        activity.lastMutation = performance.now();
+    }).observe(document.documentElement, {
+        subtree: true, childList: true
+    });
+    if (document.documentElement) {
+        observe();
+    } else {
+        document.addEventListener("readystatechange", observe, {once: true});
+    }
+})();
+"""
+
+MILLISECONDS_SINCE_MUTATION_SCRIPT = """
+() => window.__captureActivity
+    ? performance.now() - window.__captureActivity.lastMutation
+    : Infinity
+"""
+
+# Scrolls one viewport down, returns whether the bottom has been reached
+SCROLL_STEP_SCRIPT = """
+() => {
+    window.scrollBy(0, window.innerHeight);
+    return window.scrollY + window.innerHeight >= document.body.scrollHeight - 1;
+}
+"""
+
+# Same lookup the logo extraction used to do element by element through
+# Playwright handles: every element with "logo" in its class, id or alt,
+# first its own src/background-image, then those of its descendants.
+LOGO_CANDIDATES_SCRIPT = """
+() => {
+    const logoSource = (el) => {
+        const src = el.getAttribute("src");
+        if (src) {
+            return src;
+        }
+        const backgroundImage = getComputedStyle(el).backgroundImage;
+        if (backgroundImage && backgroundImage.includes("url(")) {
+            return backgroundImage.split("url(")[1].split(")")[0]
+                .replace(/^["']|["']$/g, "");
+        }
+        return null;
+    };
+    const candidates = [];
+    const elements = document.querySelectorAll("[class*=logo], [id*=logo], [alt*=logo]");
+    elements.forEach(el => {
+        const src = logoSource(el);
+        if (src) {
+            candidates.push({src: src, fromChild: false, tag: el.tagName});
+        }
+        el.querySelectorAll("*").forEach(child => {
+            const childSrc = logoSource(child);
+            if (childSrc) {
+                candidates.push({src: childSrc, fromChild: true, tag: child.tagName});
+            }
+        });
+    });
+    return {elementCount: elements.length, candidates: candidates};
+}
+"""
+
+# Rules of every readable stylesheet. For a <style> element, inDocument
+# flags the rules that are also in its text (and so in the saved HTML),
+# the others were inserted by scripts.
+STYLESHEETS_SCRIPT = """
+() => {
+    const sheets = [];
+    Array.from(document.styleSheets).forEach(sheet => {
+        let rules;
+        try {
+            rules = Array.from(sheet.cssRules).map(rule => rule.cssText);
+        } catch (e) {
+            // Cross-origin sheets do not expose their rules
+            return;
+        }
+        let inDocument = rules.map(() => false);
+        const owner = sheet.ownerNode;
+        if (!sheet.href && owner && owner.tagName === "STYLE" && owner.textContent.trim()) {
+            try {
+                const parsed = new CSSStyleSheet();
+                parsed.replaceSync(owner.textContent);
+                const texts = new Set(Array.from(parsed.cssRules).map(rule => rule.cssText));
+                inDocument = rules.map(text => texts.has(text));
+            } catch (e) {
+                // Keep every rule when the text can not be parsed on its own
+            }
+        }
+        sheets.push({href: sheet.href, rules: rules, inDocument: inDocument});
+    });
+    return sheets;
+}
+"""
+
+
+# Attribute recording the width in CSS pixels an <img> was rendered at in
+# the capture viewport, image_optimizer derives the sizes of its srcset
+# from it
+RENDERED_WIDTH_ATTRIBUTE = "data-rendered-width"
+
+RENDERED_WIDTH_SCRIPT = """
+(attribute) => {
+    document.querySelectorAll("img").forEach(image => {
+        const width = Math.round(image.getBoundingClientRect().width);
+        if (width > 0) {
+            image.setAttribute(attribute, String(width));
+        }
+    });
+}
+"""
+
+
+# Everything later pipeline stages need from the live page, collected
+# during a single navigation so no stage has to load the URL again
+class PageCapture:
+    def __init__(
+        self,
+        url,
+        html,
+        full_page_screenshot,
+        viewport_screenshot,
+        logo_candidates,
+        logo_element_count,
+        stylesheets,
+        responses=None,
+    ):
+        self.url = url
+        self.html = html
+        self.full_page_screenshot = full_page_screenshot
+        self.viewport_screenshot = viewport_screenshot
+        self.logo_candidates = logo_candidates
+        self.logo_element_count = logo_element_count
+        # [{"href", "rules", "inDocument"}] for every readable stylesheet
+        self.stylesheets = stylesheets
+        # ResponseStore with the asset bodies the browser downloaded
+        self.responses = responses if responses is not None else ResponseStore()
+
+
+# Counts the requests of a page that are still waiting for an answer
+class NetworkActivity:
+    def __init__(self, page):
+        self._started = {}
+        page.on("request", self._on_request)
+        page.on("requestfinished", self._on_done)
+        page.on("requestfailed", self._on_done)
+
+    def _on_request(self, request):
+        self._started[request] = time.monotonic()
+
+    def _on_done(self, request):
+        self._started.pop(request, None)
+
+    def pending(self):
+        cutoff = time.monotonic() - LONG_REQUEST_SECONDS
+        return sum(1 for started in self._started.values() if started > cutoff)
+
+
+# Function to wait until no request is pending and the DOM has not changed
+# for quiet_ms, returns False when the deadline passes first
+def wait_until_stable(page, network, deadline, quiet_ms=stable_quiet_ms):
+    while True:
+        if network.pending() == 0:
+            since_mutation = page.evaluate(MILLISECONDS_SINCE_MUTATION_SCRIPT)
+            if since_mutation is None or since_mutation >= quiet_ms:
+                return True
+        if time.monotonic() >= deadline:
+            return False
+        page.wait_for_timeout(POLL_INTERVAL_MS)
+
+
+# Function to scroll through the page one viewport at a time so lazy content
+# gets loaded, waiting after each step only as long as the page keeps
+# loading. Stops once the bottom is reached and stays put, or when the
+# time budget is spent.
+def load_lazy_content(page, network, time_budget=scroll_time_budget):
+    deadline = time.monotonic() + time_budget
+
+    def step_deadline():
+        return min(deadline, time.monotonic() + scroll_step_timeout)
+
+    wait_until_stable(page, network, step_deadline())
+    while time.monotonic() < deadline:
+        at_bottom = page.evaluate(SCROLL_STEP_SCRIPT)
+        wait_until_stable(page, network, step_deadline())
+        # Infinite scroll pages grow while we wait, only stop when they did not
+        if at_bottom and page.evaluate(
+            "window.scrollY + window.innerHeight >= document.body.scrollHeight - 1"
+        ):
+            return True
+    return False
+
+
+# Function to remove cookie banners: the closest ancestor (up to 5 levels,
+# below <body>) of every element mentioning "cookies"
+def remove_cookie_elements(page):
+    elements_with_cookies = page.query_selector_all(':text("cookies")')
+
+    for element in elements_with_cookies:
+        current_element = element
+        iteration_count = 0
+        try:
+            # Finding and removing parent elements
+            while True:
+                parent = current_element.query_selector("xpath=..")
+                if (
+                    parent
+                    and parent.evaluate("(element) => element.tagName") != "BODY"
+                    and iteration_count < 5
+                ):
+                    current_element = parent
+                    iteration_count += 1
+                else:
+                    break
+        except Exception as e:
+            print(f"An error occurred: {str(e)}")
+
+        # Removing the identified element
+        if current_element:
+            try:
+                current_element.evaluate("(element) => element.remove()")
+            except Exception as e:
+                print(f"An error occurred while removing the element: {str(e)}")
+
+
+# Function to load the URL once and capture DOM, screenshots, logo
+# candidates and stylesheet rules from that single page visit.
+# Trackers and unneeded resource types are blocked unless a router without
+# blocking rules is passed or REQUEST_BLOCKING_ENABLED is 0.
+def capture_page(url, remove_cookie_banners=False, viewport=VIEWPORT, router=None):
+    if router is None:
+        router = (
+            RequestRouter()
+            if request_blocking_enabled
+            else RequestRouter(blocked_domains=[], blocked_resource_types=[])
+        )
+    with span("capture") as capture_attributes, get_browser_pool().new_context(
+        viewport=viewport
+    ) as context:
+        router.install(context)
+        page = context.new_page()
+        router.store.attach(page)
+        page.add_init_script(DOM_ACTIVITY_SCRIPT)
+        network = NetworkActivity(page)
+
+        with span("capture.goto"):
+            page.goto(url)
+
+        with span("capture.scroll") as scroll_attributes:
+            scroll_attributes["reached_bottom"] = load_lazy_content(page, network)
+
+        if remove_cookie_banners:
+            with span("capture.cookie_banners"):
+                remove_cookie_elements(page)
+
+        # Scroll to the beginning so that elements like navbar are not hidden,
+        # then give sticky headers and transitions a short moment to settle
+        with span("capture.settle"):
+            page.evaluate("window.scrollTo(0, 0)")
+            wait_until_stable(page, network, time.monotonic() + 2)
+
+        with span("capture.snapshot"):
+            page.evaluate(RENDERED_WIDTH_SCRIPT, RENDERED_WIDTH_ATTRIBUTE)
+            html = page.content()
+            viewport_screenshot = page.screenshot()
+            full_page_screenshot = page.screenshot(full_page=True)
+            logos = page.evaluate(LOGO_CANDIDATES_SCRIPT)
+            stylesheets = page.evaluate(STYLESHEETS_SCRIPT)
+            router.store.flush()
+
+        capture_attributes.update(
+            html_bytes=len(html),
+            recorded_responses=len(router.store),
+            recorded_bytes=router.store.total_bytes,
+            **{f"requests_{key}": value for key, value in router.stats.items()},
+        )
+
+    return PageCapture(
+        url=url,
+        html=html,
+        full_page_screenshot=full_page_screenshot,
+        viewport_screenshot=viewport_screenshot,
+        logo_candidates=logos["candidates"],
+        logo_element_count=logos["elementCount"],
+        stylesheets=stylesheets,
+        responses=router.store,
+    )
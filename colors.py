@@ -0,0 +1,114 @@
+import os
+import numpy as np
+from PIL import Image
+from sklearn.cluster import KMeans
+
+# Upper bound on the pixels looked at per screenshot, larger images are
+# downsampled first
+color_pixel_budget = int(os.environ.get("COLOR_PIXEL_BUDGET", 65536))
+# Bits kept per channel when building the color histogram (32768 bins at 5)
+QUANTIZATION_BITS = 5
+
+
+# Function to shrink an image to at most max_pixels, returns an RGBA array
+def downsample(image, max_pixels=color_pixel_budget):
+    image = image.convert("RGBA")
+    pixel_count = image.width * image.height
+    if pixel_count > max_pixels:
+        scale = (max_pixels / pixel_count) ** 0.5
+        size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+        image = image.resize(size, Image.BOX)
+    return np.asarray(image)
+
+
+# Function to map (N, 3) int pixels to their quantized histogram bin
+def histogram_bins(pixels):
+    quantized = pixels >> (8 - QUANTIZATION_BITS)
+    return (
+        quantized[:, 0] << (2 * QUANTIZATION_BITS)
+        | quantized[:, 1] << QUANTIZATION_BITS
+        | quantized[:, 2]
+    )
+
+
+# Histogram of the quantized colors of an (N, 3) pixel array: the mean
+# color of every non-empty bin and the number of pixels that fell into it
+def color_histogram(pixels, bin_ids):
+    bin_count = 1 << (3 * QUANTIZATION_BITS)
+    counts = np.bincount(bin_ids, minlength=bin_count)
+    occupied = np.nonzero(counts)[0]
+    weights = counts[occupied]
+    sums = np.stack(
+        [
+            np.bincount(bin_ids, weights=pixels[:, channel], minlength=bin_count)[occupied]
+            for channel in range(3)
+        ],
+        axis=1,
+    )
+    return sums / weights[:, None], weights
+
+
+# Function to cluster a color histogram into n_colors colors, ordered from
+# the most to the least common one
+def palette_from_histogram(colors, weights, n_colors):
+    if n_colors == 1 or len(colors) <= n_colors:
+        if n_colors == 1:
+            centers = [np.average(colors, axis=0, weights=weights)]
+            center_weights = [weights.sum()]
+        else:
+            order = np.argsort(-weights)
+            centers = list(colors[order])
+            center_weights = list(weights[order])
+            # Fewer distinct colors than requested: repeat the dominant one
+            while len(centers) < n_colors:
+                centers.append(centers[0])
+                center_weights.append(0)
+    else:
+        # At most 32768 weighted points: a full KMeans is cheap, mini-batches
+        # would be biased towards the dominant bins and drop small but
+        # distinct colors
+        kmeans = KMeans(n_clusters=n_colors, n_init=3, random_state=0)
+        labels = kmeans.fit_predict(colors, sample_weight=weights)
+        centers = kmeans.cluster_centers_
+        center_weights = np.bincount(labels, weights=weights, minlength=n_colors)
+
+    order = np.argsort(-np.asarray(center_weights, dtype=float), kind="stable")
+    return np.asarray(centers)[order].round(0).astype(int)
+
+
+# Function to compute the header, background and palette colors of a
+# screenshot from one downsampled pass over its pixels. The header colors
+# come from the top header_fraction of the image.
+def extract_palettes(
+    image,
+    header_fraction=0.05,
+    header_colors=2,
+    palette_colors=4,
+    max_pixels=color_pixel_budget,
+):
+    rgba = downsample(image, max_pixels)
+    height, width = rgba.shape[:2]
+    header_rows = max(1, int(height * header_fraction))
+
+    pixels = rgba.reshape(-1, 4)
+    # Ignore transparent pixels unless the whole image is transparent
+    visible = pixels[:, 3] >= 128
+    if not visible.any():
+        visible[:] = True
+    header_visible = visible.copy()
+    header_visible[header_rows * width :] = False
+    if not header_visible.any():
+        header_visible[: header_rows * width] = True
+
+    # Quantize once, the header and the full image histograms share the bins
+    rgb = pixels[:, :3].astype(np.int32)
+    bin_ids = histogram_bins(rgb)
+
+    colors, weights = color_histogram(rgb[visible], bin_ids[visible])
+    header_hist = color_histogram(rgb[header_visible], bin_ids[header_visible])
+
+    return (
+        palette_from_histogram(*header_hist, header_colors),
+        palette_from_histogram(colors, weights, 1),
+        palette_from_histogram(colors, weights, palette_colors),
+    )
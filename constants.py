@@ -4,4 +4,72 @@ font_styles = {
     'PlayfairDisplay': "font-family: 'Playfair Display', serif;",
     'Roboto': "font-family: 'Roboto', sans-serif;",
     'SpaceGrotesk': "font-family: 'Space Grotesk', sans-serif;"
-}
\ No newline at end of file
+}
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36"
+}
+
+# Resource types no generated site uses, never loaded during capture
+BLOCKED_RESOURCE_TYPES = ["media", "texttrack", "eventsource", "websocket", "manifest"]
+
+# Analytics, advertising, session recording, chat and video widget hosts.
+# Subdomains are blocked as well.
+BLOCKED_DOMAINS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googletagservices.com",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "doubleclick.net",
+    "adservice.google.com",
+    "connect.facebook.net",
+    "analytics.tiktok.com",
+    "ads-twitter.com",
+    "static.ads-twitter.com",
+    "snap.licdn.com",
+    "bat.bing.com",
+    "clarity.ms",
+    "hotjar.com",
+    "hotjar.io",
+    "fullstory.com",
+    "mouseflow.com",
+    "crazyegg.com",
+    "segment.com",
+    "segment.io",
+    "mixpanel.com",
+    "amplitude.com",
+    "heap.io",
+    "heapanalytics.com",
+    "optimizely.com",
+    "nr-data.net",
+    "newrelic.com",
+    "quantserve.com",
+    "scorecardresearch.com",
+    "adnxs.com",
+    "criteo.com",
+    "criteo.net",
+    "taboola.com",
+    "outbrain.com",
+    "amazon-adsystem.com",
+    "hs-analytics.net",
+    "hs-banner.com",
+    "hsadspixel.net",
+    "intercom.io",
+    "intercomcdn.com",
+    "drift.com",
+    "driftt.com",
+    "zdassets.com",
+    "zopim.com",
+    "tawk.to",
+    "crisp.chat",
+    "livechatinc.com",
+    "tidio.co",
+    "youtube.com",
+    "youtube-nocookie.com",
+    "ytimg.com",
+    "vimeo.com",
+    "vimeocdn.com",
+    "wistia.com",
+    "wistia.net",
+]
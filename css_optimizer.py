@@ -0,0 +1,140 @@
+import os
+import re
+from urllib.parse import urldefrag
+from css_rewriter import CSS_TOKEN_PATTERN
+
+# Drop rules of the computed stylesheet dump whose selectors match nothing
+# in the saved page. Off by default: scripts of the page may still add the
+# classes those rules are written for.
+css_prune_unused = os.environ.get("CSS_PRUNE_UNUSED", "0") == "1"
+css_minify = os.environ.get("CSS_MINIFY", "1") == "1"
+
+# Grouping at-rules whose nested rules can be pruned one by one
+GROUPING_AT_RULES = ("@media", "@supports", "@container", "@layer", "@document")
+
+# Pseudo-elements and state dependent pseudo-classes can not match a static
+# document, they are removed from a selector before it is tested
+STATE_PSEUDO_PATTERN = re.compile(
+    r"::?(?:before|after|first-line|first-letter|placeholder|selection|marker"
+    r"|backdrop|file-selector-button|hover|focus-visible|focus-within|focus"
+    r"|active|visited|link|target|checked|-[\w-]+)(?:\([^)]*\))?",
+    re.IGNORECASE,
+)
+
+
+# Function to split CSS text into its top level rules
+def split_rules(css_text):
+    rules = []
+    depth = 0
+    start = 0
+    for match in CSS_TOKEN_PATTERN.finditer(css_text):
+        if match.group("open"):
+            depth += 1
+        elif match.group("close"):
+            depth = max(depth - 1, 0)
+            if depth == 0:
+                rules.append(css_text[start : match.end()].strip())
+                start = match.end()
+        elif match.group("semicolon") and depth == 0:
+            rules.append(css_text[start : match.end()].strip())
+            start = match.end()
+    rules.append(css_text[start:].strip())
+    return [rule for rule in rules if rule]
+
+
+# Function to pick the rules of the captured stylesheets (see
+# capture.STYLESHEETS_SCRIPT) that the saved site does not have yet: rules
+# of external sheets in covered_hrefs are in the saved css files, and rules
+# found in the text of a <style> element are in the saved HTML. What is left
+# are mostly rules inserted by scripts (CSS-in-JS) and rules of sheets that
+# could not be saved. Identical rules are kept once, at their last position,
+# which is the one that wins the cascade.
+def uncovered_rules(stylesheets, covered_hrefs):
+    covered_hrefs = {urldefrag(href)[0] for href in covered_hrefs}
+    rules = []
+    for sheet in stylesheets:
+        href = sheet.get("href")
+        if href and urldefrag(href)[0] in covered_hrefs:
+            continue
+        in_document = sheet.get("inDocument") or [False] * len(sheet["rules"])
+        rules += [
+            rule for rule, covered in zip(sheet["rules"], in_document) if not covered
+        ]
+
+    seen = set()
+    unique_rules = []
+    for rule in reversed(rules):
+        if rule not in seen:
+            seen.add(rule)
+            unique_rules.append(rule)
+    unique_rules.reverse()
+    return unique_rules
+
+
+# Function to tell whether a selector list matches an element of the document
+def selector_matches(selector, soup):
+    selector = STATE_PSEUDO_PATTERN.sub("", selector).strip()
+    if not selector or selector.endswith((",", ">", "+", "~")):
+        return True
+    try:
+        return soup.select_one(selector) is not None
+    except Exception:
+        # Selectors soupsieve does not support are kept
+        return True
+
+
+# Function to remove the style rules matching nothing in soup, returns the
+# pruned rule or None when nothing of it is left
+def prune_rule(rule, soup):
+    if "{" not in rule:
+        return rule
+    prelude = rule[: rule.index("{")].strip()
+    if prelude.startswith("@"):
+        if not prelude.lower().startswith(GROUPING_AT_RULES):
+            return rule
+        body = rule[rule.index("{") + 1 : rule.rindex("}")]
+        nested_rules = [
+            pruned
+            for pruned in (prune_rule(nested, soup) for nested in split_rules(body))
+            if pruned
+        ]
+        if not nested_rules:
+            return None
+        return prelude + " {\n" + "\n".join(nested_rules) + "\n}"
+    return rule if selector_matches(prelude, soup) else None
+
+
+def prune_unused_rules(rules, soup):
+    return [pruned for pruned in (prune_rule(rule, soup) for rule in rules) if pruned]
+
+
+def _minify_plain(text):
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\s*([{};,>])\s*", r"\1", text)
+    text = re.sub(r":\s+", ":", text)
+    return text.replace(";}", "}")
+
+
+# Function to remove comments and whitespace the browser does not need.
+# Strings and url() values are copied as they are.
+def minify_css(css_text):
+    parts = []
+    position = 0
+    for match in CSS_TOKEN_PATTERN.finditer(css_text):
+        if match.group("comment") or match.group("string") or match.group("url"):
+            parts.append(_minify_plain(css_text[position : match.start()]))
+            if not match.group("comment"):
+                parts.append(match.group(0))
+            position = match.end()
+    parts.append(_minify_plain(css_text[position:]))
+    return "".join(parts).strip()
+
+
+# Function to build the global stylesheet of a site from the captured
+# stylesheets: duplicates of the saved sheets removed, unused rules pruned
+# when prune_soup is given
+def build_global_stylesheet(stylesheets, covered_hrefs, prune_soup=None):
+    rules = uncovered_rules(stylesheets, covered_hrefs)
+    if prune_soup is not None:
+        rules = prune_unused_rules(rules, prune_soup)
+    return "\n".join(rules)
@@ -0,0 +1,108 @@
+import re
+
+# One scan over a stylesheet finds every token the rewrite cares about.
+# Comments and strings are matched as whole tokens so that a url( or a
+# brace inside them is never mistaken for a real one.
+CSS_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<comment>/\*.*?\*/)
+    | (?P<url>url\(\s*(?P<quote>['"]?)(?P<url_value>.*?)(?P=quote)\s*\))
+    | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+    | (?P<font_face>@font-face\b)
+    | (?P<import>@import\b)
+    | (?P<open>\{)
+    | (?P<close>\})
+    | (?P<semicolon>;)
+    """,
+    re.VERBOSE | re.DOTALL | re.IGNORECASE,
+)
+
+# Kinds of references found in a stylesheet
+IMAGE = "image"
+FONT = "font"
+IMPORT = "import"
+
+
+# A URL referenced by a stylesheet: url() values, @font-face sources and
+# @import targets. start and end delimit the whole token in the CSS text.
+class CssReference:
+    def __init__(self, kind, url, start, end, is_url_token):
+        self.kind = kind
+        self.url = url
+        self.start = start
+        self.end = end
+        self.is_url_token = is_url_token
+
+    def key(self):
+        return (self.kind, self.url)
+
+
+# Function to tokenize a stylesheet once and return its references in order
+def find_css_references(css_text):
+    references = []
+    depth = 0
+    font_face_depth = None
+    font_face_pending = False
+    in_import = False
+
+    for match in CSS_TOKEN_PATTERN.finditer(css_text):
+        if match.group("comment"):
+            continue
+
+        if match.group("url"):
+            if in_import:
+                kind = IMPORT
+            elif font_face_depth is not None:
+                kind = FONT
+            else:
+                kind = IMAGE
+            references.append(
+                CssReference(
+                    kind, match.group("url_value").strip(), match.start(), match.end(), True
+                )
+            )
+        elif match.group("string"):
+            if in_import:
+                references.append(
+                    CssReference(
+                        IMPORT, match.group("string")[1:-1], match.start(), match.end(), False
+                    )
+                )
+        elif match.group("font_face"):
+            font_face_pending = True
+        elif match.group("import"):
+            in_import = True
+        elif match.group("open"):
+            depth += 1
+            if font_face_pending:
+                font_face_depth = depth
+                font_face_pending = False
+        elif match.group("close"):
+            if font_face_depth == depth:
+                font_face_depth = None
+            depth = max(depth - 1, 0)
+            in_import = False
+        elif match.group("semicolon"):
+            in_import = False
+
+    return references
+
+
+# Function to write the stylesheet with its references replaced in one
+# pass. replacements maps CssReference.key() to the new URL, references
+# without a replacement are kept as they are.
+def rewrite_css_references(css_text, references, replacements):
+    parts = []
+    position = 0
+    for reference in references:
+        new_url = replacements.get(reference.key())
+        if new_url is None or new_url == reference.url:
+            continue
+        parts.append(css_text[position : reference.start])
+        if reference.is_url_token:
+            parts.append(f'url("{new_url}")')
+        else:
+            parts.append(f'"{new_url}"')
+        position = reference.end
+    parts.append(css_text[position:])
+    return "".join(parts)
@@ -0,0 +1,94 @@
+from bs4 import Tag
+
+
+# State of one rewrite() run, handed to every handler
+class RewritePass:
+    def __init__(self, soup, on_asset=None):
+        self.soup = soup
+        # True while the walk is inside <body>
+        self.in_body = False
+        self.asset_urls = []
+        self._on_asset = on_asset
+        self._deferred = []
+        # Children of unwrapped elements, still to be walked
+        self.adopted = []
+
+    # Records an asset URL found in the document, e.g. to start its download
+    def add_asset(self, url):
+        if not url:
+            return
+        self.asset_urls.append(url)
+        if self._on_asset is not None:
+            self._on_asset(url)
+
+    # Removes tag from the document but keeps its children in its place,
+    # the walk still visits them
+    def unwrap(self, tag):
+        self.adopted.extend(child for child in tag.contents if isinstance(child, Tag))
+        tag.unwrap()
+
+    # Schedules fn() to run after the walk. Lower phases run first, and
+    # callbacks of the same phase run in document order.
+    def defer(self, fn, phase=0):
+        self._deferred.append((phase, len(self._deferred), fn))
+
+    # Runs the deferred callbacks up to max_phase (all of them by default)
+    def run_deferred(self, max_phase=None):
+        deferred = sorted(self._deferred, key=lambda item: item[:2])
+        self._deferred = [
+            item for item in deferred if max_phase is not None and item[0] > max_phase
+        ]
+        for phase, _, fn in deferred:
+            if max_phase is None or phase <= max_phase:
+                fn()
+
+
+# Applies every registered transformation to a document in a single walk.
+# Handlers are registered per tag name ("*" matches every element) and are
+# called as handler(tag, rewrite_pass) in registration order; they may
+# modify or remove the tag, record asset URLs and defer work that has to
+# wait for the walk to finish (for example for downloads).
+class DomRewriter:
+    def __init__(self):
+        self._handlers = {}
+        self._any_handlers = []
+
+    def register(self, tag_names, handler):
+        if tag_names == "*":
+            self._any_handlers.append(handler)
+            return
+        if isinstance(tag_names, str):
+            tag_names = [tag_names]
+        for name in tag_names:
+            self._handlers.setdefault(name, []).append(handler)
+
+    # Walks the document once, then runs the deferred callbacks.
+    # on_asset(url) is called for every asset URL as soon as it is found.
+    def rewrite(self, soup, on_asset=None, run_deferred=True):
+        rewrite_pass = RewritePass(soup, on_asset)
+        # Iterative depth first walk in document order: (node, inside <body>)
+        stack = [(child, False) for child in reversed(soup.contents) if isinstance(child, Tag)]
+        while stack:
+            tag, in_body = stack.pop()
+            rewrite_pass.in_body = in_body
+            for handler in self._handlers.get(tag.name, []) + self._any_handlers:
+                handler(tag, rewrite_pass)
+                # A handler removed the element, skip the remaining handlers
+                if tag.parent is None:
+                    break
+            if tag.parent is None:
+                if rewrite_pass.adopted:
+                    stack.extend(
+                        (child, in_body) for child in reversed(rewrite_pass.adopted)
+                    )
+                    rewrite_pass.adopted = []
+                continue
+            children_in_body = in_body or tag.name == "body"
+            stack.extend(
+                (child, children_in_body)
+                for child in reversed(tag.contents)
+                if isinstance(child, Tag)
+            )
+        if run_deferred:
+            rewrite_pass.run_deferred()
+        return rewrite_pass
@@ -0,0 +1,319 @@
+import os
+import time
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from constants import HEADERS
+from http_cache import get_http_cache
+from instrumentation import current_trace
+
+# Concurrent downloads per job
+download_max_workers = int(os.environ.get("DOWNLOAD_MAX_WORKERS", 16))
+# Concurrent downloads per host, shared by every job of the process
+download_max_per_host = int(os.environ.get("DOWNLOAD_MAX_PER_HOST", 6))
+# Seconds to wait for a connection, and for each read of the body
+download_connect_timeout = float(os.environ.get("DOWNLOAD_CONNECT_TIMEOUT", 10))
+download_timeout = float(os.environ.get("DOWNLOAD_TIMEOUT", 30))
+# Largest body accepted for one asset, and for all the assets of a job
+download_max_asset_bytes = int(
+    float(os.environ.get("DOWNLOAD_MAX_ASSET_MB", 25)) * 1024 * 1024
+)
+download_max_job_bytes = int(
+    float(os.environ.get("DOWNLOAD_MAX_JOB_MB", 500)) * 1024 * 1024
+)
+http_cache_enabled = os.environ.get("HTTP_CACHE_ENABLED", "1") == "1"
+# Extra attempts after a connection error, a timeout or a 502/503/504
+download_retries = int(os.environ.get("DOWNLOAD_RETRIES", 1))
+RETRY_STATUS_CODES = (502, 503, 504)
+RETRY_BACKOFF_SECONDS = 0.5
+
+CHUNK_SIZE = 64 * 1024
+# Bytes looked at to tell the type of a body
+SNIFF_BYTES = 64
+
+# Signatures of the binary formats a site references, checked in order
+CONTENT_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"\x00\x00\x01\x00", "image/x-icon"),
+    (b"wOFF", "font/woff"),
+    (b"wOF2", "font/woff2"),
+    (b"OTTO", "font/otf"),
+    (b"\x00\x01\x00\x00", "font/ttf"),
+]
+
+_session = None
+_session_lock = threading.Lock()
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+# Function to get the process wide session, keeps connections alive between
+# requests and jobs with one connection pool per host
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = HTTPAdapter(
+                pool_connections=64, pool_maxsize=download_max_per_host
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def _host_semaphore(url):
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(download_max_per_host)
+            _host_semaphores[host] = semaphore
+        return semaphore
+
+
+# Download refused because its body is larger than the asset or job budget
+class DownloadTooLarge(requests.exceptions.RequestException):
+    pass
+
+
+# Function to tell the type of a body from its first bytes, None if unknown
+def sniff_content_type(data):
+    head = data[:SNIFF_BYTES]
+    for signature, content_type in CONTENT_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        return "image/avif" if head[8:12] in (b"avif", b"avis") else None
+    text = head.lstrip().lower()
+    if text.startswith(b"<svg") or (
+        text.startswith(b"<?xml") and b"<svg" in data[:1024].lower()
+    ):
+        return "image/svg+xml"
+    if text.startswith((b"<!doctype html", b"<html")):
+        return "text/html"
+    return None
+
+
+# Body and headers of a finished download. cache_status tells where the body
+# came from: "miss" (network), "hit" (fresh cache entry), "revalidated"
+# (cache entry confirmed by a 304 answer) or "browser" (recorded during capture)
+class FetchResult:
+    def __init__(
+        self, url, status_code, headers, content, cache_status="miss", sniffed_type=None
+    ):
+        self.url = url
+        self.status_code = status_code
+        self.headers = (
+            headers
+            if isinstance(headers, CaseInsensitiveDict)
+            else CaseInsensitiveDict(headers or {})
+        )
+        self.content = content
+        self.cache_status = cache_status
+        # Type told by the first bytes of the body, see sniff_content_type()
+        self.sniffed_type = sniffed_type or sniff_content_type(content)
+
+    @property
+    def text(self):
+        encoding = requests.utils.get_encoding_from_headers(self.headers)
+        content_type = self.headers.get("Content-Type", "")
+        if encoding and "charset" in content_type.lower():
+            return self.content.decode(encoding, errors="replace")
+        try:
+            return self.content.decode("utf-8")
+        except UnicodeDecodeError:
+            return self.content.decode("latin-1")
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(
+                f"{self.status_code} Error for url: {self.url}"
+            )
+
+
+# Fetches the assets of one job concurrently. Every URL is requested at most
+# once per job: prefetch() schedules downloads in the background and fetch()
+# waits for the scheduled download or starts it. Assets the browser already
+# downloaded during capture are served from response_store (a ResponseStore)
+# and only the rest goes to the network. Bodies are streamed and the
+# download is abandoned as soon as it exceeds max_asset_bytes, or once the
+# job received max_job_bytes in total.
+class Downloader:
+    def __init__(
+        self,
+        max_workers=download_max_workers,
+        cache=None,
+        response_store=None,
+        max_asset_bytes=download_max_asset_bytes,
+        max_job_bytes=download_max_job_bytes,
+    ):
+        if cache is None and http_cache_enabled:
+            cache = get_http_cache()
+        self.cache = cache
+        self.response_store = response_store
+        self.max_asset_bytes = max_asset_bytes
+        self.max_job_bytes = max_job_bytes
+        self.received_bytes = 0
+        # Every fetch is recorded as an "asset_fetch" span of the job trace
+        self.trace = current_trace()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="downloader"
+        )
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _download(self, url):
+        start = time.time()
+        started = time.perf_counter()
+        attributes = {"url": url, "retries": 0}
+        try:
+            result = self._fetch_result(url, attributes)
+            attributes["status_code"] = result.status_code
+            result.raise_for_status()
+            return result
+        except Exception as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            if self.trace is not None:
+                self.trace.record(
+                    "fetch",
+                    "asset_fetch",
+                    start,
+                    time.perf_counter() - started,
+                    **attributes,
+                )
+
+    def _fetch_result(self, url, attributes):
+        if self.response_store is not None:
+            recorded = self.response_store.get(url)
+            if recorded is not None:
+                attributes.update(cache_status="browser", bytes=len(recorded.body))
+                return FetchResult(
+                    url, recorded.status_code, recorded.headers, recorded.body, "browser"
+                )
+
+        cached = self.cache.get(url) if self.cache is not None else None
+        if cached is not None and cached.is_fresh():
+            body = cached.read_body()
+            attributes.update(cache_status="hit", bytes=len(body))
+            return FetchResult(url, cached.status_code, cached.headers, body, "hit")
+
+        request_headers = cached.validators() if cached is not None else {}
+        for attempt in range(download_retries + 1):
+            if attempt:
+                attributes["retries"] = attempt
+                time.sleep(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            try:
+                with _host_semaphore(url):
+                    with get_session().get(
+                        url,
+                        headers=request_headers,
+                        timeout=(download_connect_timeout, download_timeout),
+                        stream=True,
+                    ) as response:
+                        if (
+                            response.status_code in RETRY_STATUS_CODES
+                            and attempt < download_retries
+                        ):
+                            continue
+                        if response.status_code == 304 and cached is not None:
+                            content = None
+                        else:
+                            content, sniffed_type = self._read_body(url, response)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= download_retries:
+                    raise
+
+        if content is None:
+            self.cache.refresh(cached, response.headers)
+            body = cached.read_body()
+            attributes.update(cache_status="revalidated", bytes=len(body))
+            result = FetchResult(
+                url, cached.status_code, cached.headers, body, "revalidated"
+            )
+        else:
+            attributes.update(cache_status="miss", bytes=len(content))
+            result = FetchResult(
+                url, response.status_code, response.headers, content, "miss", sniffed_type
+            )
+            if self.cache is not None:
+                try:
+                    self.cache.store(url, response.status_code, response.headers, content)
+                except OSError:
+                    pass
+        return result
+
+    def _reserve(self, url, size):
+        with self._lock:
+            if self.received_bytes + size > self.max_job_bytes:
+                raise DownloadTooLarge(
+                    f"Job download budget of {self.max_job_bytes} bytes spent at {url}"
+                )
+            self.received_bytes += size
+
+    # Reads a streamed body chunk by chunk within the byte budgets, returns
+    # the body and the type sniffed from its first chunk
+    def _read_body(self, url, response):
+        declared_length = response.headers.get("Content-Length")
+        if declared_length and declared_length.isdigit():
+            if int(declared_length) > self.max_asset_bytes:
+                raise DownloadTooLarge(
+                    f"{url} is {declared_length} bytes, the limit is {self.max_asset_bytes}"
+                )
+
+        chunks = []
+        size = 0
+        sniffed_type = None
+        for chunk in response.iter_content(CHUNK_SIZE):
+            if not chunks:
+                sniffed_type = sniff_content_type(chunk)
+            size += len(chunk)
+            if size > self.max_asset_bytes:
+                raise DownloadTooLarge(
+                    f"{url} is larger than {self.max_asset_bytes} bytes"
+                )
+            self._reserve(url, len(chunk))
+            chunks.append(chunk)
+        return b"".join(chunks), sniffed_type
+
+    def _future(self, url):
+        with self._lock:
+            future = self._futures.get(url)
+            if future is None:
+                future = self._executor.submit(self._download, url)
+                self._futures[url] = future
+            return future
+
+    def prefetch(self, urls):
+        for url in urls:
+            if url and url.startswith(("http:", "https:")):
+                self._future(url)
+
+    # Returns the FetchResult of url, raises if the download failed
+    def fetch(self, url):
+        return self._future(url).result()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,44 +1,193 @@
-from bs4 import BeautifulSoup
 import sys
+from bs4 import Tag
 from constants import font_styles
+from html_backend import parse_fragment
+from site_editor import EditError, document_cache, site_html_path
 
-if len(sys.argv) < 2:
-    print("Please provide command line arguments.")
-    sys.exit(1)
 
-folder_name = sys.argv[1]
-template = sys.argv[2]
-font = sys.argv[3]
+# Class generate_site adds to every element of a page, followed by its id
+UNIQUE_CLASS_PREFIX = "unique-class-"
 
-# Specify the path to your local HTML file
-html_file_path = f"static/{folder_name}/index.html"
 
-# Open and read the local HTML file
-with open(html_file_path, "r") as file:
-    html = file.read()
+# Function to get a field of an operation that has to be a string or missing
+def string_field(operation, name, default=None):
+    value = operation.get(name, default)
+    if value is not None and not isinstance(value, str):
+        raise EditError(f"{name} must be a string")
+    return value
 
-# Parsing HTML using BeautifulSoup
-soup = BeautifulSoup(html, "html.parser")
 
-# Find the 'container' div in the HTML
-container = soup.find('div', class_='container')
-if font != '0':
+# Function to get the element marked with a unique class
+def find_unique(soup, unique_class):
+    if not unique_class:
+        raise EditError("Missing target")
+    element = soup.find(class_=unique_class)
+    if element is None:
+        raise EditError(f"No element with class {unique_class}")
+    return element
+
+
+# Function to set the font of the 'container' div
+def set_font(soup, font):
+    if font == '0':
+        return
+    if font not in font_styles:
+        raise EditError(f"Unknown font {font}")
+    container = soup.find('div', class_='container')
+    if container is None:
+        raise EditError("No container to set the font of")
     container['style'] = font_styles[font]
 
-# Find the 'flex-container' div in the HTML
-flex_container = soup.find("div", class_="flex-container")
 
-# Find 'image-column' and 'text-column' blocks within the 'flex-container'
-image_column = flex_container.find("div", class_="image-column")
-text_column = flex_container.find("div", class_="text-column")
+# Function to order the columns of the 'flex-container' div for a template,
+# without a template the two columns swap places
+def arrange_columns(soup, template=None):
+    flex_container = soup.find("div", class_="flex-container")
+    if flex_container is None:
+        raise EditError("No columns to arrange")
+
+    # Find 'image-column' and 'text-column' blocks within the 'flex-container'
+    image_column = flex_container.find("div", class_="image-column")
+    text_column = flex_container.find("div", class_="text-column")
+    if image_column is None or text_column is None:
+        raise EditError("No columns to arrange")
+
+    if template is None:
+        columns = flex_container.find_all("div", class_=["image-column", "text-column"])
+        template = '1' if columns[0] is image_column else '2'
+
+    # If the 'template' is 1, swap the positions of 'image-column' and 'text-column'
+    if template == '1':
+        image_column.insert_before(text_column)
+    # If the 'template' is 2, leave the order unchanged
+    elif template == '2':
+        image_column.insert_after(text_column)
+
+
+def _replace(element, nodes):
+    for node in nodes:
+        element.insert_before(node)
+    element.decompose()
+
+
+# Function to replace the element marked with a unique class by new HTML
+def replace_node(soup, unique_class, html):
+    element = find_unique(soup, unique_class)
+    _replace(element, parse_fragment(html or ""))
+
+
+# Function to get the unique class of the first element of parsed nodes
+def unique_class_of(nodes):
+    for node in nodes:
+        if isinstance(node, Tag):
+            for class_name in node.get("class", []):
+                if class_name.startswith(UNIQUE_CLASS_PREFIX):
+                    return class_name
+            return None
+    return None
+
+
+# Function to apply a node changed in the editor: html is its new outer
+# HTML, which replaces the element carrying the same unique class
+def patch_node(soup, html, unique_class=None):
+    nodes = parse_fragment(html or "")
+    unique_class = unique_class or unique_class_of(nodes)
+    if unique_class is None:
+        raise EditError("Patch without a unique class")
+    _replace(find_unique(soup, unique_class), nodes)
+
+
+# Function to set an attribute of the element marked with a unique class,
+# a value of None removes the attribute
+def set_attribute(soup, unique_class, name, value):
+    if not name:
+        raise EditError("Missing attribute name")
+    element = find_unique(soup, unique_class)
+    if value is None:
+        del element[name]
+    else:
+        element[name] = value
+
+
+# Function to set the text of the element marked with a unique class
+def set_text(soup, unique_class, text):
+    find_unique(soup, unique_class).string = text or ""
+
+
+# Operations of a batch edit, called with the document and the operation
+EDIT_OPERATIONS = {
+    "set_font": lambda soup, operation: set_font(
+        soup, string_field(operation, "font", "0")
+    ),
+    "swap_columns": lambda soup, operation: arrange_columns(
+        soup, string_field(operation, "template")
+    ),
+    "replace_node": lambda soup, operation: replace_node(
+        soup, string_field(operation, "target"), string_field(operation, "html")
+    ),
+    "set_attribute": lambda soup, operation: set_attribute(
+        soup,
+        string_field(operation, "target"),
+        string_field(operation, "name"),
+        string_field(operation, "value"),
+    ),
+    "set_text": lambda soup, operation: set_text(
+        soup, string_field(operation, "target"), string_field(operation, "text")
+    ),
+    "patch_node": lambda soup, operation: patch_node(
+        soup, string_field(operation, "html"), string_field(operation, "target")
+    ),
+}
+
+
+# Function to apply a list of operations to a document in order
+def apply_operations(soup, operations):
+    for index, operation in enumerate(operations):
+        name = operation.get("op") if isinstance(operation, dict) else None
+        apply = EDIT_OPERATIONS.get(name) if isinstance(name, str) else None
+        if apply is None:
+            raise EditError(f"Operation {index}: unknown operation {name}")
+        try:
+            apply(soup, operation)
+        except EditError as e:
+            raise EditError(f"Operation {index} ({name}): {e}") from None
+
+
+# Function to apply a batch of operations to a generated site. The document
+# is parsed at most once and written once; when an operation fails none of
+# the batch is written. Returns the path of its index.html.
+def edit_site(slug, operations):
+    html_file_path = site_html_path(slug)
+    with document_cache.edit(html_file_path) as soup:
+        apply_operations(soup, operations)
+    return html_file_path
+
+
+# Function to apply the nodes changed in the editor to a generated site,
+# every patch is {"html": outer HTML, "target": unique class (optional)}
+def patch_site(slug, patches):
+    operations = []
+    for index, patch in enumerate(patches):
+        if not isinstance(patch, dict):
+            raise EditError(f"Patch {index} is not an object")
+        operations.append(
+            {"op": "patch_node", "html": patch.get("html"), "target": patch.get("target")}
+        )
+    return edit_site(slug, operations)
+
+
+# Function to apply the template and font chosen in the editor to a
+# generated site, returns the path of its index.html
+def edit_generated_site(slug, template, font):
+    return edit_site(
+        slug,
+        [{"op": "set_font", "font": font}, {"op": "swap_columns", "template": template}],
+    )
+
 
-# If the 'template' is 1, swap the positions of 'image-column' and 'text-column'
-if template == '1':
-    image_column.insert_before(text_column)
-# If the 'template' is 2, leave the order unchanged
-elif template == '2':
-    image_column.insert_after(text_column)
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Please provide command line arguments.")
+        sys.exit(1)
 
-# Save the modified HTML code to a file or print it to the screen
-with open(f"static/{folder_name}/index.html", "w") as file:
-    file.write(str(soup))
+    edit_generated_site(sys.argv[1], sys.argv[2], sys.argv[3])
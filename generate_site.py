@@ -1,58 +1,112 @@
 import os
 import random
-from playwright.sync_api import sync_playwright
+from capture import RENDERED_WIDTH_ATTRIBUTE, capture_page
+from colors import extract_palettes
 from PIL import Image
 from io import BytesIO
-import numpy as np
-from sklearn.cluster import KMeans
 import shutil
 import requests
+from downloader import Downloader, sniff_content_type
+from asset_store import JobAssets
+from image_optimizer import ImageOptimizer, image_optimization_enabled
+from dom_rewriter import DomRewriter
+import css_rewriter
+from css_optimizer import (
+    build_global_stylesheet,
+    css_minify,
+    css_prune_unused,
+    minify_css,
+)
+from html_backend import parse_html, serialize_html
+from instrumentation import span
+from site_manifest import SiteManifest, content_hash, fingerprint, site_incremental
 from urllib.parse import urljoin, unquote
 from bs4 import BeautifulSoup
 import re
 import openai
 from dotenv import load_dotenv
 import sys
-import uuid
+import itertools
 from constants import font_styles
 import base64
 from urllib.parse import urlparse
-import time
-import imghdr
 import json
 
-load_dotenv()
-
-# Check if a URL argument is provided in the command line
-if len(sys.argv) < 2:
-    print("Please provide a URL as a command line argument.")
-    sys.exit(1)
-
-url = sys.argv[1]
-new_site_folder_name = sys.argv[2]
-title = sys.argv[3]
-template = sys.argv[4]
-font = sys.argv[5]
-base_url = os.getenv("BASE_URL")
-openai.api_key = os.getenv("OPENAI_API_KEY")
-initial_directory = os.getcwd()
-logo_path = ""
-logo_extension = ""
-global_soup = ""
+# Sites are written next to this file, where app.py serves them from
+script_directory = os.path.dirname(os.path.abspath(__file__))
 html_file_name = "index.html"
+screenshot_file_name = "screenshot.png"
 assets_folder_name = "assets"
 static_folder_name = "static"
 js_folder_name = "js"
 font_folder_name = "fonts"
 css_folder_name = "css"
-assets_base_url = (
-    f"{base_url}/{static_folder_name}/{new_site_folder_name}/{assets_folder_name}"
-)
 valid_image_extensions = [".jpg", ".jpeg", ".png", ".gif", ".bmp"]
-scrapped_text = ""
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36"
-}
+
+
+# State of one site generation. Every path is absolute and nothing is kept
+# in module globals, so several jobs can run in the same process (threads
+# or asyncio tasks) without depending on the working directory.
+class SiteJob:
+    def __init__(
+        self,
+        url,
+        slug,
+        title,
+        template="0",
+        font="DMSans",
+        progress=None,
+        output_root=None,
+    ):
+        self.url = url
+        self.slug = slug
+        self.title = title
+        self.template = template
+        self.font = font
+        self.progress_callback = progress
+        self.base_url = os.getenv("BASE_URL")
+        self.site_base_url = f"{self.base_url}/{static_folder_name}/{slug}"
+        self.assets_base_url = f"{self.site_base_url}/{assets_folder_name}"
+
+        output_root = output_root or os.path.join(script_directory, static_folder_name)
+        self.site_dir = os.path.abspath(os.path.join(output_root, slug))
+        self.assets_dir = os.path.join(self.site_dir, assets_folder_name)
+        self.css_dir = os.path.join(self.site_dir, css_folder_name)
+        self.fonts_dir = os.path.join(self.site_dir, font_folder_name)
+        self.js_dir = os.path.join(self.site_dir, js_folder_name)
+        self.html_path = os.path.join(self.site_dir, html_file_name)
+        self.screenshot_path = os.path.join(self.site_dir, screenshot_file_name)
+
+        # File name of the logo in the assets folder, and its extension
+        self.logo_path = ""
+        self.logo_extension = ""
+        self.soup = None
+        self.scrapped_text = ""
+        self.downloader = None
+        self.job_assets = None
+        # Converts the saved <img> sources to WebP variants, template "0" only
+        self.image_optimizer = None
+        # Fonts and stylesheets saved by the job, keyed by their URL
+        self.saved_fonts = {}
+        self.saved_stylesheets = {}
+        # Files of the site, loaded from the previous run of the slug
+        self.manifest = None
+        # Set when the page did not change and the previous output is kept
+        self.reused = False
+
+    # Public URL of a file saved into one of the site folders
+    def file_url(self, folder_name, filename):
+        return f"{self.site_base_url}/{folder_name}/{filename}"
+
+    def create_folders(self):
+        for folder in (
+            self.site_dir,
+            self.assets_dir,
+            self.css_dir,
+            self.fonts_dir,
+            self.js_dir,
+        ):
+            create_folder(folder)
 
 
 def log_error(text):
@@ -67,53 +121,27 @@ def log_info(text):
     print("\033[93m" + text + "\033[0m")
 
 
+# Function to report pipeline stage progress to the job that runs it
+def report_progress(job, stage, state):
+    if job.progress_callback is None:
+        return
+    try:
+        job.progress_callback(stage, state)
+    except Exception as e:
+        log_error(f"[ERROR] Failed to report progress of stage {stage}: {e}")
+
+
 # Function to create a folder if it doesn't exist
 def create_folder(folder_name):
-    if not os.path.exists(folder_name):
-        os.mkdir(folder_name)
+    try:
+        os.makedirs(folder_name)
         log_success(f'[SUCCESS] Folder "{folder_name}" created.')
-    else:
+    except FileExistsError:
         log_info(f'[INFO] Folder "{folder_name}" already exists.')
 
 
-create_folder(static_folder_name)
-
-os.chdir(static_folder_name)
-
-log_info(f'[INFO] Navigate to "{static_folder_name}".')
-
-create_folder(new_site_folder_name)
-
-os.chdir(new_site_folder_name)
-
-log_info(f'[INFO] Navigate to "{new_site_folder_name}".')
-
-create_folder(assets_folder_name)
-create_folder(css_folder_name)
-create_folder(font_folder_name)
-create_folder(js_folder_name)
-
-
-# Function to extract logo URL from an HTML element
-def extract_logo_from_element(element):
-    # Check for src attribute (useful for img, source, etc.)
-    logo_src = element.get_attribute("src")
-    if logo_src:
-        return logo_src
-
-    # If no src, check for background image
-    background_image = element.evaluate("el => getComputedStyle(el).backgroundImage")
-    if background_image and "url(" in background_image:
-        # Extract URL from the 'url()' CSS function
-        return background_image.split("url(")[1].split(")")[0].strip('"').strip("'")
-
-    return None
-
-
 # Function to download and save the logo
-def download_and_save_logo(base_url, logo_url, save_path="logo_extracted"):
-    global logo_path
-    global logo_extension
+def download_and_save_logo(job, base_url, logo_url, save_name="logo_extracted"):
     """Download the logo from the provided URL and save it with its original format."""
     try:
         # Handle protocol-relative URLs
@@ -124,12 +152,13 @@ def download_and_save_logo(base_url, logo_url, save_path="logo_extracted"):
         elif not logo_url.startswith(("http:", "https:")):
             logo_url = urljoin(base_url, logo_url)
 
-        response = requests.get(logo_url, stream=True, headers=HEADERS)
-        response.raise_for_status()
+        response = job.downloader.fetch(logo_url)
 
+        # Servers that send no usable Content-Type still send the bytes
         content_type = (
-            response.headers.get("Content-Type", "").split("/")[1].split(";")[0]
+            response.headers.get("Content-Type") or response.sniffed_type or ""
         )
+        content_type = content_type.split(";")[0].strip().partition("/")[2]
 
         # Determine the file extension based on the content type
         if content_type in ["jpeg", "jpg"]:
@@ -143,117 +172,52 @@ def download_and_save_logo(base_url, logo_url, save_path="logo_extracted"):
         else:
             file_extension = "png"  # Default to PNG if the content type is unknown
 
-        save_path = f"{save_path}.{file_extension}"
-        logo_path = f"logo.{file_extension}"
-        logo_extension = file_extension
+        save_path = os.path.join(job.site_dir, f"{save_name}.{file_extension}")
+        job.logo_path = f"logo.{file_extension}"
+        job.logo_extension = file_extension
 
         with open(save_path, "wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
+            file.write(response.content)
         log_success(f"[SUCCESS] Logo saved to: {save_path}")
 
     except Exception as e:
         log_error(f"[ERROR] Failed to download and save logo: {e}")
 
 
-# Function to extract logo source URL from a website
-def extract_logo_src(url):
-    log_info(f"\n[INFO] Processing URL: {url}\n")
-
-    with sync_playwright() as p:
-        log_info("[INFO] Launching browser...")
-        browser = p.chromium.launch()
-        page = browser.new_page()
-        page.goto(url)
-        img_elements = page.query_selector_all("img")
-
-        img_src_list = []
-
-        for img_element in img_elements:
-            src = img_element.get_attribute("src")
-            if src:
-                img_src_list.append(src)
+# Function to pick the logo among the captured candidates and download it
+def extract_logo_src(job, capture):
+    log_info(f"\n[INFO] Processing URL: {capture.url}\n")
 
-        # Find any element with 'logo' in its class or ID
-        logo_elements = page.query_selector_all(
-            "[class*=logo], [id*=logo], [alt*=logo]"
-        )
-
-        log_info(
-            f"[INFO] Found {len(logo_elements)} elements with 'logo' in class or ID."
-        )
+    log_info(
+        f"[INFO] Found {capture.logo_element_count} elements with 'logo' in class or ID."
+    )
 
-        for element in logo_elements:
-            logo_src = extract_logo_from_element(element)
-            if logo_src and not logo_src.startswith("data:image"):
+    for candidate in capture.logo_candidates:
+        logo_src = candidate["src"]
+        if logo_src and not logo_src.startswith("data:image"):
+            if candidate["fromChild"]:
+                log_info(f"[INFO] Extracted logo URL from child element: {logo_src}")
+            else:
                 log_info(f"[INFO] Extracted logo URL: {logo_src}")
-                # download_and_save_logo(url, logo_src)  # Save the logo
-                browser.close()
-                return logo_src
-
-            # Also check child elements
-            children = element.query_selector_all("*")  # Get all children
-            for child in children:
-                logo_src = extract_logo_from_element(child)
-                if logo_src and not logo_src.startswith("data:image"):
-                    log_info(
-                        f"[INFO] Extracted logo URL from child element: {logo_src}"
-                    )
-                    download_and_save_logo(url, logo_src)  # Save the logo
-                    browser.close()
-                    return logo_src
+            download_and_save_logo(job, capture.url, logo_src)  # Save the logo
+            return logo_src
 
-        log_info("[INFO] No logo found in the analyzed elements.")
-        browser.close()
+    log_info("[INFO] No logo found in the analyzed elements.")
     return None
 
 
-# Function to extract image URLs from a website
-def extract_image_urls_from_website(soup: BeautifulSoup):
-    log_info(f"\n[INFO] Processing URL: {url}\n")
-    image_urls = []
-    img_tags = soup.find_all("img")
-    parsed_url = urlparse(url)
-    root_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
-    for image in img_tags:
-        src = image.get("src")
-        if src:
-            try:
-                if src.startswith("data:image"):
-                    data_parts = src.split(",")
-                    if len(data_parts) == 2:
-                        data_type, data_base64 = data_parts
-                        ext = data_type.split(";")[0].split(":")[1]
-                        ext = get_image_extension(content_type=ext, img_name="")
-                        while len(data_base64) % 4 != 0:
-                            data_base64 += "="
-                        data = base64.b64decode(data_base64)
-                        filename = f"{str(uuid.uuid4())}{ext}"
-
-                        with open(os.path.join("assets", filename), "wb") as img_file:
-                            img_file.write(data)
-
-                        new_url = f"{assets_base_url}/{filename}"
-                        image["src"] = new_url
-                        del image["srcset"]
-
-                        image_urls.append(new_url)
-                    else:
-                        log_error("[ERROR] Invalid data URI format")
-                if not src.startswith(("http:", "https:")):
-                    src = urljoin(root_url, src)
-                    image_urls.append(src)
-                    new_url = download_and_move_images(src, save_path="assets")
-                    image["src"] = new_url
-                    del image["srcset"]
-
-                else:
-                    image_urls.append(src)
-                    new_url = download_and_move_images(src, save_path="assets")
-                    image["src"] = new_url
-                    del image["srcset"]
-            except Exception as e:
-                log_error(f"[ERROR] An error occurred: {e}")
+# Function to download the images of a page and point them at the local copies
+def extract_image_urls_from_website(job, soup: BeautifulSoup):
+    log_info(f"\n[INFO] Processing URL: {job.url}\n")
+    rewriter = DomRewriter()
+    # Resolve relative sources against the page like the browser did, so
+    # that they match the responses recorded during capture
+    rewriter.register("img", image_rewriter(job, job.url))
+    # Every download starts during the walk, the deferred replacements
+    # then only wait for them
+    rewriter.rewrite(
+        soup, on_asset=lambda asset_url: job.downloader.prefetch([asset_url])
+    )
     return soup
 
 
@@ -262,7 +226,28 @@ def clean_filename(filename):
     return re.sub(r'[\/:*?"<>|]', "_", filename)
 
 
-def get_image_extension(content_type, img_name):
+# Function to name a saved file after its source URL, so that every run
+# of a slug saves a URL to the same file
+def url_file_name(source_url, extension):
+    return content_hash(source_url)[:16] + extension
+
+
+# File extensions of the image types, from the Content-Type header or
+# sniffed from the first bytes of the body
+IMAGE_EXTENSIONS_BY_TYPE = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/bmp": ".bmp",
+    "image/tiff": ".tiff",
+    "image/svg+xml": ".svg",
+    "image/webp": ".webp",
+    "image/avif": ".avif",
+    "image/x-icon": ".ico",
+}
+
+
+def get_image_extension(content_type, img_name, sniffed_type=None):
     _, extension = os.path.splitext(img_name)
     if extension.lower() in (
         ".jpg",
@@ -277,110 +262,73 @@ def get_image_extension(content_type, img_name):
         return extension
 
     if content_type is not None:
-        if content_type == "image/jpeg":
-            extension = ".jpg"
-        elif content_type == "image/png":
-            extension = ".png"
-        elif content_type == "image/gif":
-            extension = ".gif"
-        elif content_type == "image/bmp":
-            extension = ".bmp"
-        elif content_type == "image/tiff":
-            extension = ".tiff"
-        elif content_type == "image/svg+xml":
-            extension = ".svg"
-        elif content_type == "image/webp":
-            extension = ".webp"
-        else:
-            image_response = requests.get(url, headers=HEADERS)
-            image_content = image_response.content
-            image_type = imghdr.what(None, h=image_content)
-            if image_type:
-                extension = "." + image_type
-            else:
-                extension = ".jpg"
+        content_type = content_type.split(";")[0].strip().lower()
+        if content_type in IMAGE_EXTENSIONS_BY_TYPE:
+            return IMAGE_EXTENSIONS_BY_TYPE[content_type]
 
-        return extension
-
-    return ".jpg"
+    # Servers often answer application/octet-stream or nothing at all, the
+    # first bytes of the body still tell the type
+    return IMAGE_EXTENSIONS_BY_TYPE.get(sniffed_type, ".jpg")
 
 
-# Function to download and move images to the specified directory
-def download_and_move_images(img_url, save_path="assets"):
+# Function to download an image into the assets folder, returns its new URL.
+# Every URL is saved once per job and named after the hash of its content.
+def download_and_move_images(job, img_url):
     try:
+        new_url = job.job_assets.lookup(img_url)
+        if new_url:
+            return new_url
+
         if img_url.startswith("data:image"):
             data_parts = img_url.split(",")
             if len(data_parts) == 2:
                 data_type, data_base64 = data_parts
                 ext = data_type.split(";")[0].split(":")[1]
-                ext = get_image_extension(content_type=ext, img_name="")
-                
+
                 while len(data_base64) % 4 != 0:
                     data_base64 += "="
                 data = base64.b64decode(data_base64)
-
-                filename = f"{str(uuid.uuid4())}{ext}"
-                with open(os.path.join("assets", filename), "wb") as img_file:
-                    img_file.write(data)
-                new_url = f"{assets_base_url}/{filename}"
-                log_success(
-                    f"[SUCCESS] Image with URL({img_url}) saved to: assets/{filename}"
+                ext = get_image_extension(
+                    content_type=ext, img_name="", sniffed_type=sniff_content_type(data)
                 )
+
+                new_url = job.job_assets.save(img_url, data, ext)
+                log_success(f"[SUCCESS] Image from data URI saved to: {new_url}")
                 return new_url
             else:
                 log_error("[ERROR] Invalid data URI format")
         else:
-            if not os.path.exists(save_path):
-                os.makedirs(save_path)
-
-            img_name = str(uuid.uuid4())
-
-            response = requests.get(img_url, stream=True, headers=HEADERS)
+            response = job.downloader.fetch(img_url)
             content_type = response.headers.get("Content-Type")
-            extension = get_image_extension(content_type, img_url)
-            img_save_path = os.path.join(save_path, f"{img_name}{extension}")
-            with open(img_save_path, "wb") as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
-            log_success(
-                f"[SUCCESS] Image with URL({img_url}) saved to: {img_save_path}"
+            extension = get_image_extension(
+                content_type, img_url, sniffed_type=response.sniffed_type
             )
-            return f"{assets_base_url}/{img_name}{extension}"
+            new_url = job.job_assets.save(img_url, response.content, extension)
+            log_success(f"[SUCCESS] Image with URL({img_url}) saved to: {new_url}")
+            return new_url
     except Exception as e:
         log_error(f"[ERROR] Failed to download and move image: {e}")
         return img_url
 
 
-# Color extraction functions
-def extract_colors_from_resized(image, n_colors, max_size=1900):
-    aspect_ratio = image.width / image.height
-    if image.width > image.height:
-        new_width = max_size
-        new_height = int(max_size / aspect_ratio)
-    else:
-        new_height = max_size
-        new_width = int(max_size * aspect_ratio)
-    resized_image = image.resize((new_width, new_height))
-    return extract_colors_with_alpha(resized_image, n_colors)
-
-
-# Function to extract colors from an image with alpha channel
-def extract_colors_with_alpha(image, n_colors):
-    image_rgba = np.array(image)
-    pixels = image_rgba.reshape(-1, 4)
-    if np.all(pixels[:, 3] == 255):
-        pixels = pixels[:, :3]
-    kmeans = KMeans(n_clusters=n_colors)
-    kmeans.fit(pixels)
-    colors = kmeans.cluster_centers_
-    colors = colors.round(0).astype(int)
-    return colors
-
-
-def add_class_to_elements(element):
-    unique_class = str(uuid.uuid4())
+UNIQUE_CLASS_PREFIX = "unique-class-"
+BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+# Function to name the element_id-th element of a page: a base 36 counter
+# in document order, short and the same every time the page is generated
+def unique_class_name(element_id):
+    digits = ""
+    while True:
+        element_id, remainder = divmod(element_id, 36)
+        digits = BASE36_DIGITS[remainder] + digits
+        if not element_id:
+            return UNIQUE_CLASS_PREFIX + digits
+
+
+def add_class_to_elements(element, element_id):
     existing_classes = element.get("class", [])
-    existing_classes.append("unique-class-" + unique_class)
+    existing_classes.append(unique_class_name(element_id))
     element["class"] = existing_classes
 
 
@@ -389,386 +337,447 @@ def rgb_to_hex(rgb_values):
     return ["#{:02x}{:02x}{:02x}".format(r, g, b) for r, g, b in rgb_values]
 
 
-def replace_font_url(url_part, new_url, css_content):
-    pattern = re.compile(
-        r'@font-face\s*{[^}]*?url\s*\(\s*["\'](.*?{0}.*?)["\']\s*\)[^}]*?}'.format(
-            re.escape(url_part)
-        ),
-        re.DOTALL,
+# File extensions of the font types, from the Content-Type header when the
+# URL does not end with one
+FONT_EXTENSIONS_BY_TYPE = {
+    "font/woff2": ".woff2",
+    "font/woff": ".woff",
+    "application/font-woff": ".woff",
+    "font/ttf": ".ttf",
+    "font/otf": ".otf",
+    "application/vnd.ms-fontobject": ".eot",
+    "image/svg+xml": ".svg",
+}
+
+
+def get_font_extension(content_type, url_path):
+    _, extension = os.path.splitext(url_path)
+    if extension.lower() in set(FONT_EXTENSIONS_BY_TYPE.values()):
+        return extension.lower()
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    return FONT_EXTENSIONS_BY_TYPE.get(content_type, "")
+
+
+# Function to save a font into the fonts folder, returns its file name.
+# Named after its URL like the stylesheets and scripts, fonts of different
+# folders often share a file name.
+def save_font(job, href):
+    font_filename = job.saved_fonts.get(href)
+    if font_filename:
+        return font_filename
+    response = job.downloader.fetch(href)
+    extension = get_font_extension(
+        response.headers.get("Content-Type"), urlparse(href).path
+    )
+    font_filename = url_file_name(href, extension)
+    font_save_path = job.manifest.write(
+        href, f"{font_folder_name}/{font_filename}", response.content
     )
+    log_success(f"[SUCCESS] Font file with URL({href}) saved to: {font_save_path}")
+    job.saved_fonts[href] = font_filename
+    return font_filename
+
+
+# Function to tell whether a stylesheet reference points at something to download
+def is_localizable_css_reference(reference):
+    if not reference.url or reference.url.startswith(("#", "about:")):
+        return False
+    if reference.url.startswith("data:"):
+        # Inline images become files like the ones of the page, inline
+        # fonts and stylesheets stay where they are
+        return reference.kind == css_rewriter.IMAGE and reference.url.startswith(
+            "data:image"
+        )
+    return True
 
-    def replace_url(match):
-        original_url = match.group(1)
-        new_full_url = original_url.replace(url_part, new_url)
-        return match.group(0).replace(original_url, new_full_url)
 
-    updated_css_content = pattern.sub(replace_url, css_content)
+# Function to download everything a stylesheet references (images, @font-face
+# sources and @import targets) and point it at the local copies. The
+# stylesheet is tokenized once, every download starts before the first one
+# is awaited, and the new CSS is written in a single pass.
+def localize_stylesheet(job, css_text, sheet_url, depth=0):
+    references = css_rewriter.find_css_references(css_text)
 
-    log_success(f"[SUCCESS] Font with URL({url_part}) replaced with {new_url}")
-    return updated_css_content
+    asset_urls = {}
+    for reference in references:
+        if reference.key() not in asset_urls and is_localizable_css_reference(reference):
+            # Relative URLs resolve against the stylesheet, like in the browser
+            asset_urls[reference.key()] = urljoin(sheet_url, reference.url)
 
+    log_info(f"[INFO] Found {len(asset_urls)} assets in css code")
+    job.downloader.prefetch(asset_urls.values())
 
-def replace_bg_images_to_local(css_text, root_url):
-    background_image_pattern = re.compile(
-        r"(background|background-image)\s*:\s*url\(([^)]+)\)"
-    )
-    background_image_urls = []
-    matches = background_image_pattern.findall(css_text)
-
-    for property_name, bg_img_url in matches:
-        bg_img_url = bg_img_url.strip("url()").strip("'").strip('"')
-        background_image_urls.append(bg_img_url)
-
-    log_info(f"[INFO] Found {len(background_image_urls)} images in css code")
-    log_info("[INFO] Start downloading and replacing")
-
-    for old_url in background_image_urls:
-        if old_url:
-            # Handle relative URLs
-            if not old_url.startswith(("http:", "https:")) and not old_url.startswith(
-                "data:image"
-            ):
-                old_url = urljoin(root_url, old_url)
-            new_url = download_and_move_images(old_url, save_path="assets")
+    replacements = {}
+    for (kind, css_url), asset_url in asset_urls.items():
+        try:
+            if kind == css_rewriter.IMAGE:
+                new_url = download_and_move_images(job, asset_url)
+            elif kind == css_rewriter.FONT:
+                new_url = job.file_url(font_folder_name, save_font(job, asset_url))
+            else:
+                filename = save_stylesheet(job, asset_url, depth + 1)
+                if filename:
+                    new_url = job.file_url(css_folder_name, filename)
+                else:
+                    new_url = None
             if new_url:
-                css_text = css_text.replace(old_url, new_url)
-    return css_text
+                replacements[(kind, css_url)] = new_url
+        except Exception as e:
+            log_error(f"[ERROR] Failed to localize {asset_url} from css: {e}")
 
+    return css_rewriter.rewrite_css_references(css_text, references, replacements)
 
-# Function to scrape text from a URL
-def scrape_data_from_url(url):
-    global global_soup
+
+# Function to save a stylesheet and everything it references into the css
+# folder, returns its file name. @import chains are followed up to
+# MAX_IMPORT_DEPTH levels.
+def save_stylesheet(job, href, depth=0):
+    if href in job.saved_stylesheets:
+        return job.saved_stylesheets[href]
+    if depth > MAX_IMPORT_DEPTH:
+        return None
+
+    filename = url_file_name(href, ".css")
+    # Registered before the imports are followed, so import cycles end here
+    job.saved_stylesheets[href] = filename
     try:
-        # Step 1: Launching the browser and setting up the page
-        with sync_playwright() as p:
-            log_info("[INFO] Launching browser...")
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context(viewport={"width": 1920, "height": 1080})
-            page = context.new_page()
-
-            # Step 2: Navigating to the provided URL and scrolling to load content
-            page.goto(url)
-            scroll_interval = 0.5
-            max_scroll_attempts = 30
-            scroll_attempts = 0
-            page.wait_for_load_state("load")
-            page.wait_for_timeout(1000)
-
-            # Step 3: Scrolling down the page to load additional content
-            while scroll_attempts < max_scroll_attempts:
-                page.keyboard.press("PageDown")
-                page.keyboard.up("PageDown")
-
-                time.sleep(scroll_interval)
-
-                if page.evaluate(
-                    "window.scrollY + window.innerHeight >= document.body.scrollHeight"
-                ):
-                    break
-
-                scroll_attempts += 1
-
-            # Step 4: Handling elements related to cookies
-            elements_with_cookies = page.query_selector_all(':text("cookies")')
-
-            if elements_with_cookies:
-                # Iterating through elements and removing them
-                for element in elements_with_cookies:
-                    current_element = element
-                    iteration_count = 0
-                    try:
-                        # Finding and removing parent elements
-                        while True:
-                            parent = current_element.query_selector("xpath=..")
-                            if (
-                                parent
-                                and parent.evaluate("(element) => element.tagName")
-                                != "BODY"
-                                and iteration_count < 5
-                            ):
-                                current_element = parent
-                                iteration_count += 1
-                            else:
-                                break
-                    except Exception as e:
-                        print(f"An error occurred: {str(e)}")
-
-                    # Removing the identified element
-                    if current_element:
-                        try:
-                            current_element.evaluate("(element) => element.remove()")
-                        except Exception as e:
-                            print(
-                                f"An error occurred while removing the element: {str(e)}"
-                            )
-            # Scroll to the beginning so that elements like navbar are not hidden
-            page.evaluate("window.scrollTo(0, 0)")
-            page.wait_for_timeout(1000)
-            html = page.content()
-            soup = BeautifulSoup(html, "html.parser")
-
-            # Step 5: Remove lazy loading from images in the HTML content
-            images_with_loading_and_display_none = soup.find_all(
-                lambda tag: tag.get("loading") and tag.get("style") == "display: none;"
-            )
-            for image in images_with_loading_and_display_none:
-                del image["loading"]
-                del image["style"]
+        response = job.downloader.fetch(href)
+        css_text = localize_stylesheet(job, response.text, href, depth)
+    except Exception:
+        del job.saved_stylesheets[href]
+        raise
+
+    while len(css_text) % 4 != 0:
+        css_text += "="
+    css_save_path = job.manifest.write(href, f"{css_folder_name}/{filename}", css_text)
+    log_success(f"[SUCCESS] CSS file with URL({href}) saved to: {css_save_path}")
+    return filename
+
+
+# Deferred work of the page rewrite: downloads run in ASSETS_PHASE, the
+# stylesheets in CSS_PHASE once the fonts linked by the page are saved
+ASSETS_PHASE = 0
+CSS_PHASE = 1
+FONT_EXTENSIONS = (".ttf", ".otf", ".woff", ".woff2", ".eot")
+SCRIPT_INJECTION_PATTERN = re.compile(
+    r'createElement\("script"\).+?src=["\'](https://.+?)["\']'
+)
+INLINE_STYLE_URL_PATTERN = re.compile(r"url\(['\"]?([^)]+?)['\"]?\)")
+MAX_IMPORT_DEPTH = 5
 
-            page.wait_for_timeout(1000)
 
-            # Step 6: Taking a full-page screenshot and saving it
-            screenshot = page.screenshot(path="screenshot.png", full_page=True)
-            image = Image.open(BytesIO(screenshot))
-            image.save("screensht.png")
+# Function to resolve a URL found in the page against its root URL
+def resolve_page_url(root_url, href):
+    if href.startswith(("http:", "https:", "data:")):
+        return href
+    return urljoin(root_url, href)
 
-            # Step 7: Parsing the root URL from the provided URL
-            parsed_url = urlparse(url)
-            root_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
-            base_tag = soup.find("base")
 
-            if base_tag:
-                root_url = base_tag.get("href")
+# Step 9: Save and replace the js with a local one
+def save_js_link(job, link_tag, href):
+    try:
+        response = job.downloader.fetch(href)
+        new_filename = url_file_name(href, ".js")
 
-            # Step 8: Handling script and font tags
-            if soup is not None:
-                js_elements = soup.find_all(
-                    "link", href=lambda href: href and (href.endswith(".js") or ".js" in href)
-                )
-            else:
-                log_error("[ERROR] soup is None, skipping js_elements extraction")
+        js_text = response.text
+        job.manifest.write(href, f"{js_folder_name}/{new_filename}", js_text)
 
-            font_elements = soup.find_all(
-                "link",
-                href=lambda href: href
-                and href.endswith((".ttf", ".otf", ".woff", ".woff2", ".eot")),
-            )
+        full_link = job.file_url(js_folder_name, new_filename)
+        link_tag["href"] = f"{full_link}"
 
-            font_names = []
-
-            # Step 9: Save and replace the js with a local one
-            for js_element in js_elements:
-                try:
-                    href = js_element.get("href")
-                    if not href.startswith(("http:", "https:")):
-                        href = urljoin(root_url, href)
-                    response = requests.get(href, stream=False, headers=HEADERS)
-                    response.raise_for_status()
-                    new_filename = str(uuid.uuid4()) + ".js"
-
-                    js_text = response.text
-                    js_save_path = os.path.join(js_folder_name, f"{new_filename}")
-
-                    with open(js_save_path, "w", encoding="utf-8") as file:
-                        file.write(js_text)
-
-                    full_link = f"{base_url}/{static_folder_name}/{new_site_folder_name}/{js_folder_name}/{new_filename}"
-                    js_element["href"] = f"{full_link}"
-
-                except Exception as e:
-                    log_error(f"[ERROR] Failed to load JS: {e}")
-
-            # Step 9: Save and replace the fonts with a local one
-            for font_element in font_elements:
-                try:
-                    href = font_element.get("href")
-                    if not href.startswith(("http:", "https:")):
-                        href = urljoin(root_url, href)
-                    response = requests.get(href, stream=False, headers=HEADERS)
-                    response.raise_for_status()
-                    url_path = urlparse(href).path
-                    font_filename = os.path.basename(url_path)
-                    font_save_path = os.path.join(font_folder_name, f"{font_filename}")
-                    with open(font_save_path, "wb") as font_file:
-                        font_file.write(response.content)
-                    log_success(
-                        f"[SUCCESS] Font file with URL({href}) saved to: {font_save_path}"
-                    )
-                    full_link = f"{base_url}/{static_folder_name}/{new_site_folder_name}/{font_folder_name}/{font_filename}"
-                    font_element["href"] = f"{full_link}"
-                    font_names.append(font_filename)
+    except Exception as e:
+        log_error(f"[ERROR] Failed to load JS: {e}")
+
+
+# Step 9: Save and replace the fonts with a local one
+def save_font_link(job, link_tag, href):
+    try:
+        font_filename = save_font(job, href)
+        full_link = job.file_url(font_folder_name, font_filename)
+        link_tag["href"] = f"{full_link}"
+
+    except Exception as e:
+        log_error(f"[ERROR] Failed to load Font: {e}")
+
+
+# Step 10: Save the source of a script tag
+def save_script_src(job, script_tag, href):
+    try:
+        response = job.downloader.fetch(href)
+        js_filename = url_file_name(href, ".js")
+        js_pattern = r'createElement\("script"\);'
+        js_text = response.text
+        js_text = re.sub(js_pattern, "", js_text)
+        js_save_path = job.manifest.write(
+            href, f"{js_folder_name}/{js_filename}", js_text
+        )
+        log_success(f"[SUCCESS] JS file with URL({href}) saved to: {js_save_path}")
+        full_link = job.file_url(js_folder_name, js_filename)
+        script_tag["src"] = f"{full_link}"
+
+    except Exception as e:
+        log_error(f"[ERROR] Failed to load JS: {e}")
+
+
+# Step 11: Save the stylesheet with its images, fonts and imports and link the local copy
+def save_css_link(job, link_tag, href):
+    try:
+        filename = save_stylesheet(job, href)
+        full_link = job.file_url(css_folder_name, filename)
+        link_tag["href"] = f"{full_link}"
+    except Exception as e:
+        log_error(f"[ERROR] Failed to download and save CSS file: {e}")
+
+
+# Step 11: Localize the images, fonts and imports of a <style> element, its
+# rules are not repeated in the global stylesheet
+def save_style_element(job, style_tag, root_url):
+    try:
+        style_tag.string = localize_stylesheet(job, style_tag.string, root_url)
+    except Exception as e:
+        log_error(f"[ERROR] Failed to localize style element: {e}")
 
-                except Exception as e:
-                    log_error(f"[ERROR] Failed to load Font: {e}")
 
-            script_tags = soup.find_all("script")
+# Replace the source of an image with the local copy
+def save_image_src(job, image, src, rendered_width=None):
+    try:
+        new_url = download_and_move_images(job, src)
+        if new_url:
+            image["src"] = new_url
+            del image["srcset"]
+            if job.image_optimizer is not None:
+                job.image_optimizer.submit(image, new_url, rendered_width)
+    except Exception as e:
+        log_error(f"[ERROR] An error occurred: {e}")
+
+
+# Step 13: Replace the background image urls inside an inline style
+def save_inline_style_images(job, tag, urls):
+    for old_url, asset_url in urls:
+        new_url = download_and_move_images(job, asset_url)
+        if new_url:
+            tag["style"] = tag["style"].replace(old_url, new_url)
+
+
+# Handler to remove lazy loading from images in the HTML content (Step 5)
+def unhide_lazy_element(tag, rewrite_pass):
+    if tag.get("loading") and tag.get("style") == "display: none;":
+        del tag["loading"]
+        del tag["style"]
 
-            pattern = re.compile(
-                r'createElement\("script"\).+?src=["\'](https://.+?)["\']'
+
+# Handler that points <img> tags at their local copies
+def image_rewriter(job, root_url):
+    def rewrite_image(image, rewrite_pass):
+        rendered_width = image.attrs.pop(RENDERED_WIDTH_ATTRIBUTE, None)
+        src = image.get("src")
+        if src:
+            src = resolve_page_url(root_url, src)
+            rewrite_pass.add_asset(src)
+            rewrite_pass.defer(
+                lambda: save_image_src(job, image, src, rendered_width), ASSETS_PHASE
             )
 
-            # Step 10: Find scripts that create other scripts within themselves with a link to external sources
-            for script_tag in script_tags:
-                script_tag["crossorigin"] = "anonymous"
-                try:
-                    href = script_tag.get("src")
-                    if href:
-                        if not href.startswith(("http:", "https:")):
-                            href = urljoin(root_url, href)
-                        response = requests.get(href, stream=False, headers=HEADERS)
-                        response.raise_for_status()
-                        js_filename = str(uuid.uuid4()) + ".js"
-                        js_pattern = r'createElement\("script"\);'
-                        js_text = response.text
-                        js_text = re.sub(js_pattern, "", js_text)
-                        js_save_path = os.path.join(js_folder_name, f"{js_filename}")
-                        with open(js_save_path, "w", encoding="utf-8") as js_file:
-                            js_file.write(js_text)
-                        log_success(
-                            f"[SUCCESS] JS file with URL({href}) saved to: {js_save_path}"
-                        )
-                        full_link = f"{base_url}/{static_folder_name}/{new_site_folder_name}/{js_folder_name}/{js_filename}"
-                        script_tag["src"] = f"{full_link}"
+    return rewrite_image
+
+
+# Function to build the rewriter applying every change template "0" makes
+# to the captured page, so the document only has to be walked once
+def build_page_rewriter(job, root_url):
+    rewriter = DomRewriter()
+
+    def rewrite_link(link_tag, rewrite_pass):
+        href = link_tag.get("href")
+        if not href:
+            return
+        asset_url = resolve_page_url(root_url, href)
+        # Checked from most to least specific: CDN hosts like cdn.jsdelivr.net
+        # contain ".js" in stylesheet URLs too
+        if ".css" in href:
+            rewrite_pass.add_asset(asset_url)
+            rewrite_pass.defer(
+                lambda: save_css_link(job, link_tag, asset_url), CSS_PHASE
+            )
+        elif href.endswith(FONT_EXTENSIONS):
+            rewrite_pass.add_asset(asset_url)
+            rewrite_pass.defer(
+                lambda: save_font_link(job, link_tag, asset_url), ASSETS_PHASE
+            )
+        elif ".js" in href:
+            rewrite_pass.add_asset(asset_url)
+            rewrite_pass.defer(
+                lambda: save_js_link(job, link_tag, asset_url), ASSETS_PHASE
+            )
 
-                except Exception as e:
-                    log_error(f"[ERROR] Failed to load JS: {e}")
+    # Step 10: Find scripts that create other scripts within themselves with a link to external sources
+    def rewrite_script(script_tag, rewrite_pass):
+        script_tag["crossorigin"] = "anonymous"
+        src = script_tag.get("src")
+        if src:
+            src = resolve_page_url(root_url, src)
+            rewrite_pass.add_asset(src)
+            rewrite_pass.defer(
+                lambda: save_script_src(job, script_tag, src), ASSETS_PHASE
+            )
 
-                script_content = script_tag.string
+        script_content = script_tag.string
+        if script_content:
+            match = SCRIPT_INJECTION_PATTERN.search(script_content)
+            if match and match.group(1).startswith("https"):
+                script_tag.extract()
 
-                if script_content:
-                    match = pattern.search(script_content)
-                    if match:
-                        print(match)
-                        src = match.group(1)
-                        if src.startswith("https"):
-                            script_tag.extract()
+    def rewrite_style(style_tag, rewrite_pass):
+        if style_tag.string:
+            rewrite_pass.defer(
+                lambda: save_style_element(job, style_tag, root_url), CSS_PHASE
+            )
 
-            body_tag = soup.body
+    def remove_href(tag, rewrite_pass):
+        del tag["href"]
+
+    # Parsers that do not know <source> is void nest the following
+    # siblings (the <img> of a <picture>) inside it, those are kept
+    def remove_tag(tag, rewrite_pass):
+        rewrite_pass.unwrap(tag)
+
+    # Elements are numbered in document order
+    element_ids = itertools.count()
+
+    def add_unique_class(tag, rewrite_pass):
+        if rewrite_pass.in_body:
+            add_class_to_elements(tag, next(element_ids))
+
+    def rewrite_inline_style(tag, rewrite_pass):
+        style = tag.get("style")
+        if not style:
+            return
+        urls = []
+        for old_url in INLINE_STYLE_URL_PATTERN.findall(style):
+            asset_url = resolve_page_url(root_url, old_url) if old_url else old_url
+            rewrite_pass.add_asset(asset_url)
+            urls.append((old_url, asset_url))
+        if urls:
+            rewrite_pass.defer(
+                lambda: save_inline_style_images(job, tag, urls), ASSETS_PHASE
+            )
 
-            # remove_empty_divs(body_tag)
+    rewriter.register("link", rewrite_link)
+    rewriter.register("script", rewrite_script)
+    rewriter.register("style", rewrite_style)
+    rewriter.register("img", image_rewriter(job, root_url))
+    rewriter.register(["button", "a"], remove_href)
+    rewriter.register("source", remove_tag)
+    # Handlers for every element run after the tag specific ones, in this
+    # order: lazy styles go before their urls are collected
+    rewriter.register("*", unhide_lazy_element)
+    rewriter.register("*", add_unique_class)
+    rewriter.register("*", rewrite_inline_style)
+    return rewriter
 
-            for element in body_tag.find_all():
-                add_class_to_elements(element)
 
-            css_links = soup.find_all(
-                "link",
-                href=lambda href: href and (href.endswith(".css") or ".css" in href),
+# Function to scrape text from a URL
+def scrape_data_from_url(job):
+    url = job.url
+    try:
+        # Step 1-4: Loading the page once, scrolling it and removing cookie banners
+        capture = capture_page(url, remove_cookie_banners=True)
+        job.downloader.response_store = capture.responses
+
+        # Step 6: Saving the full-page screenshot
+        with open(job.screenshot_path, "wb") as screenshot_file:
+            screenshot_file.write(capture.full_page_screenshot)
+
+        # The page and its styles as the browser rendered them, with the
+        # settings that change the output. When neither changed since the
+        # last run of the slug, its files are kept as they are.
+        job.manifest.fingerprint = fingerprint(
+            capture.html,
+            capture.stylesheets,
+            job.template,
+            job.base_url,
+            css_prune_unused,
+            css_minify,
+            image_optimization_enabled,
+        )
+        if job.manifest.is_current():
+            log_info("[INFO] Page unchanged since the last run, keeping its files.")
+            job.manifest.reuse_previous()
+            job.reused = True
+            return None
+
+        with span("parse"):
+            soup = parse_html(capture.html)
+
+        # Step 7: Relative URLs resolve against the page URL or its <base>,
+        # the same way the browser resolved them
+        root_url = url
+        base_tag = soup.find("base")
+
+        if base_tag and base_tag.get("href"):
+            root_url = urljoin(url, base_tag.get("href"))
+
+        # Step 8: Walk the document once. Every asset download starts as soon
+        # as its tag is seen, the work that needs the downloads (Steps 9-13)
+        # is deferred until the walk is done.
+        with span("rewrite") as rewrite_attributes:
+            rewrite_pass = build_page_rewriter(job, root_url).rewrite(
+                soup,
+                on_asset=lambda asset_url: job.downloader.prefetch([asset_url]),
+                run_deferred=False,
             )
+            rewrite_attributes["assets"] = len(rewrite_pass.asset_urls)
 
-            # Step 11: Find the font url inside the css and replace them with local ones then save the new css
-            for css_tag in css_links:
-                try:
-                    href = css_tag.get("href")
-                    if href:
-                        if not href.startswith(("http:", "https:")):
-                            href = urljoin(root_url, href)
-                        response = requests.get(href, stream=False, headers=HEADERS)
-                        response.raise_for_status()
-                        filename = str(uuid.uuid4()) + ".css"
-
-                        css_text = response.text
-                        css_text = replace_bg_images_to_local(css_text, root_url)
-
-                        pattern = re.compile(
-                            r"@font-face\s*{[^}]*?url\s*\(\s*['\"]?(.*?)['\"]?\s*\)[^}]*?}",
-                            re.DOTALL,
-                        )
+        report_progress(job, "scrape", "done")
+        report_progress(job, "assets", "running")
 
-                        matches = pattern.findall(css_text)
-
-                        for font_name in font_names:
-                            for i in range(len(matches)):
-                                if font_name in matches[i]:
-                                    css_text = css_text.replace(
-                                        matches[i], f"../fonts/{font_name}"
-                                    )
-
-                        css_save_path = os.path.join(css_folder_name, f"{filename}")
-                        while len(css_text) % 4 != 0:
-                            css_text += "="
-                        with open(css_save_path, "w", encoding="utf-8") as css_file:
-                            css_file.write(css_text)
-                        full_link = f"{base_url}/{static_folder_name}/{new_site_folder_name}/{css_folder_name}/{filename}"
-                        css_tag["href"] = f"{full_link}"
-                        log_success(
-                            f"[SUCCESS] CSS file with URL({href}) saved to: {css_save_path}"
-                        )
-                except Exception as e:
-                    log_error(f"[ERROR] Failed to download and save CSS file: {e}")
-
-            head_tag = soup.head
-
-            # Step 12: Find all global styles and save them
-            try:
-                page.wait_for_timeout(3000)
-
-                all_styles = page.evaluate(
-                    """
-                    () => {
-                        const styleSheets = Array.from(document.styleSheets);
-                        const cssTextArray = [];
-
-                        styleSheets.forEach(sheet => {
-                        try {
-                            const cssRules = Array.from(sheet.cssRules);
-                            cssRules.forEach(rule => {
-                            cssTextArray.push(rule.cssText);
-                            });
-                        } catch (e) {
-                            // Handle the exception if needed
-                        }
-                        });
-
-                        return cssTextArray;
-                    }
-                    """
-                )
-                all_styles_text = "\n".join(all_styles)
-                all_styles_text = replace_bg_images_to_local(all_styles_text, root_url)
+        # Step 9-10: js, fonts, scripts, images and inline style images
+        with span("assets"):
+            rewrite_pass.run_deferred(max_phase=ASSETS_PHASE)
+
+        report_progress(job, "css", "running")
 
-                all_css_file_name = "global-" + str(uuid.uuid4()) + ".css"
-                all_css_file_path = os.path.join(
-                    css_folder_name, f"{all_css_file_name}"
+        # Step 11: stylesheets, they reuse the fonts saved in Step 9
+        with span("css"):
+            rewrite_pass.run_deferred()
+
+        head_tag = soup.head
+
+        # Step 12: Save the global styles the saved css files and <style>
+        # elements do not cover yet, mostly rules inserted by scripts
+        try:
+            with span("global_css") as global_css_attributes:
+                all_styles_text = build_global_stylesheet(
+                    capture.stylesheets,
+                    job.saved_stylesheets.keys(),
+                    prune_soup=soup if css_prune_unused else None,
                 )
+                all_styles_text = localize_stylesheet(job, all_styles_text, root_url)
+                if css_minify:
+                    all_styles_text = minify_css(all_styles_text)
 
-                with open(all_css_file_path, "w", encoding="utf-8") as css_file:
-                    css_file.write(all_styles_text)
-                full_link = f"{base_url}/{static_folder_name}/{new_site_folder_name}/{css_folder_name}/{all_css_file_name}"
+                # Named after its content, an unchanged stylesheet is not rewritten
+                all_css_file_name = (
+                    "global-" + content_hash(all_styles_text)[:16] + ".css"
+                )
+                job.manifest.write(
+                    None, f"{css_folder_name}/{all_css_file_name}", all_styles_text
+                )
+                global_css_attributes["bytes"] = len(all_styles_text)
+                full_link = job.file_url(css_folder_name, all_css_file_name)
                 new_link_tag = soup.new_tag(
                     "link", rel="stylesheet", href=unquote(full_link)
                 )
 
                 head_tag.append(new_link_tag)
 
-            except Exception as e:
-                log_error(f"[ERROR] Failed to add CSS link: {e}")
-
-            # Step 13: Find the background image url inside the inline styles and replace
-            for tag in soup.find_all(True):
-                if "style" in tag.attrs:
-                    inline_style = tag["style"]
-                    background_image_pattern = re.compile(
-                        r"url\(['\"]?([^)]+?)['\"]?\)"
-                    )
-                    matches = background_image_pattern.findall(inline_style)
-
-                    for old_url in matches:
-                        parsed_url = urlparse(url)
-                        formatted_url = old_url
-                        if old_url:
-                            # Handle relative URLs
-                            if not old_url.startswith(
-                                ("http:", "https:")
-                            ) and not old_url.startswith("data:image"):
-                                formatted_url = urljoin(root_url, old_url)
-                        new_url = download_and_move_images(
-                            formatted_url, save_path="assets"
-                        )
-                        if new_url:
-                            tag["style"] = tag["style"].replace(old_url, new_url)
-
-            for button in soup.find_all("button"):
-                del button["href"]
-
-            for a in soup.find_all("a"):
-                del a["href"]
+        except Exception as e:
+            log_error(f"[ERROR] Failed to add CSS link: {e}")
 
-            for source_tag in soup.find_all("source"):
-                source_tag.decompose()
+        report_progress(job, "css", "done")
 
-            global_soup = soup
+        job.soup = soup
 
-            return soup
+        return soup
 
     except requests.exceptions.RequestException as e:
         log_error(f"[ERORR] with request:, {e}")
@@ -776,92 +785,44 @@ def scrape_data_from_url(url):
         log_error(f"[ERROR]: {e}")
 
 
-def scrape_text_from_url(url):
-    global global_soup
+# Function to extract the text of a captured page
+def scrape_text_from_url(job, capture):
     try:
-        with sync_playwright() as p:
-            log_info("[INFO] Launching browser...")
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context(viewport={"width": 1920, "height": 1080})
-            page = context.new_page()
-
-            page.goto(url)
-            scroll_interval = 0.5
-            max_scroll_attempts = 30
-
-            scroll_attempts = 0
-            page.wait_for_load_state("load")
-            page.wait_for_timeout(1000)
-            while scroll_attempts < max_scroll_attempts:
-                page.keyboard.press("PageDown")
-                page.keyboard.up("PageDown")
-
-                time.sleep(scroll_interval)
-
-                if page.evaluate(
-                    "window.scrollY + window.innerHeight >= document.body.scrollHeight"
-                ):
-                    break
-
-                scroll_attempts += 1
-            page.wait_for_timeout(1000)
-            page.evaluate("window.scrollTo(0, 0)")
-
-            html = page.content()
-            soup = BeautifulSoup(html, "html.parser")
-            images_with_loading_and_display_none = soup.find_all(
-                lambda tag: tag.get("loading") and tag.get("style") == "display: none;"
-            )
-            for image in images_with_loading_and_display_none:
-                del image["loading"]
-                del image["style"]
-            page.wait_for_timeout(5000)
-            screenshot = page.screenshot(path="screenshot.png", full_page=True)
-            image = Image.open(BytesIO(screenshot))
-            image.save("screensht.png")
-            style_tags = soup.find_all("style", attrs={"data-styled": True})
-
-            log_info("[CSS]" + style_tags)
-            for script_tag in soup.find_all("script"):
-                script_tag.extract()
+        soup = parse_html(capture.html)
+        images_with_loading_and_display_none = soup.find_all(
+            lambda tag: tag.get("loading") and tag.get("style") == "display: none;"
+        )
+        for image in images_with_loading_and_display_none:
+            del image["loading"]
+            del image["style"]
+        with open(job.screenshot_path, "wb") as screenshot_file:
+            screenshot_file.write(capture.full_page_screenshot)
+        style_tags = soup.find_all("style", attrs={"data-styled": True})
 
-            global_soup = soup
-            text = soup.get_text()
-            words = re.findall(r"[A-Z][a-z]*", text)
-            formatted_text = " ".join(words)
+        log_info(f"[CSS] Found {len(style_tags)} styled-components style tags")
+        for script_tag in soup.find_all("script"):
+            script_tag.extract()
 
-            return formatted_text
+        job.soup = soup
+        text = soup.get_text()
+        words = re.findall(r"[A-Z][a-z]*", text)
+        formatted_text = " ".join(words)
+
+        return formatted_text
 
-    except requests.exceptions.RequestException as e:
-        log_error(f"[ERORR] with request:, {e}")
     except Exception as e:
         log_error(f"[ERROR]: {e}")
 
 
-# Scrape text from the provided URL
-if template == "0":
-    global_soup = scrape_data_from_url(url)
-elif template == "1":
-    scrapped_text = scrape_text_from_url(url)
-
-
-# Main function to extract colors from a website
-def extract_colors_from_website(url):
-    with sync_playwright() as p:
-        browser = p.chromium.launch()
-        page = browser.new_page()
-        page.goto(url)
-        screenshot = page.screenshot()
-        browser.close()
+# Main function to extract colors from the captured viewport screenshot
+def extract_colors_from_website(capture):
+    image = Image.open(BytesIO(capture.viewport_screenshot))
 
-    image = Image.open(BytesIO(screenshot))
-
-    # Extract colors from top 5% of the image for the header
-    header_colors = extract_colors_from_resized(
-        image.crop((0, 0, image.width, int(image.height * 0.05))), 2
+    # Header colors come from the top 5% of the image, all three palettes
+    # are computed from a single downsampled color histogram
+    header_colors, background_color, palette_colors = extract_palettes(
+        image, header_fraction=0.05, header_colors=2, palette_colors=4
     )
-    background_color = extract_colors_from_resized(image, 1)
-    palette_colors = extract_colors_from_resized(image, 4)
 
     return (
         rgb_to_hex(header_colors),
@@ -892,45 +853,25 @@ def get_header_text_color(hex_color):
     return [inverted_hex]
 
 
-# Call the color extraction function and logo extraction function
-header_colors = []
-background_color = []
-palette_colors = []
-header_text_color = []
-if template == "1":
-    header_colors, background_color, palette_colors = extract_colors_from_website(url)
-    header_text_color = get_header_text_color([header_colors[0]])
-    extract_logo_src(url)
-
-    # Print the extracted colors
-    log_info("\nExtracted Colors:")
-    log_info(f"Header Colors: {header_colors}")
-    log_info(f"Header Text Color: {header_text_color}")
-    log_info(f"Background Color: {background_color}")
-    log_info(f"Palette of 4 Colors: {palette_colors}")
-    log_info("\n")
-
-# Get the current working directory
-print(os.getcwd())
-
-if template == "1":
+# Function to move the extracted logo into the assets folder
+def move_logo_to_assets(job):
     try:
-        # Correct the paths considering your script's execution context
-        source_path = os.path.join(os.getcwd(), f"./logo_extracted.{logo_extension}")
-        destination_path = os.path.join(os.getcwd(), f"assets/{logo_path}")
+        source_path = os.path.join(job.site_dir, f"logo_extracted.{job.logo_extension}")
+        destination_path = os.path.join(job.assets_dir, job.logo_path)
 
         # Move the logo to the assets folder
         shutil.move(source_path, destination_path)
+        job.manifest.record(None, f"{assets_folder_name}/{job.logo_path}")
     except Exception as e:
         log_error(f"[ERROR] An error occurred while moving the logo: {e}")
 
         # If there is an error, copy "no_logo.png" to assets folder and rename it to "logo.png"
-        script_directory = os.path.dirname(os.path.abspath(__file__))
         no_logo_source = os.path.join(script_directory, "../../no_logo.png")
-        no_logo_destination = os.path.join(os.getcwd(), "assets/logo.png")
+        no_logo_destination = os.path.join(job.assets_dir, "logo.png")
 
         try:
             shutil.copy(no_logo_source, no_logo_destination)
+            job.manifest.record(None, f"{assets_folder_name}/logo.png")
             log_success("[SUCCESS] Copied 'no_logo.png' to assets folder as 'logo.png'")
         except Exception as e:
             log_error(f"[ERRORR] An error occurred while copying 'no_logo.png': {e}")
@@ -945,15 +886,11 @@ def remove_empty_divs(soup):
 
 
 def add_unique_class_to_body(html):
-    soup = BeautifulSoup(html, "html.parser")
-    global soup_with_unique_classes
-    soup_with_unique_classes = soup
+    soup = parse_html(html)
 
-    for element in soup_with_unique_classes.body.find_all():
-        unique_class = str(uuid.uuid4())
-        existing_classes = element.get("class", [])
-        existing_classes.append("unique-class-" + unique_class)
-        element["class"] = existing_classes
+    for element_id, element in enumerate(soup.body.find_all()):
+        add_class_to_elements(element, element_id)
+    return soup
 
 
 # Function to perform text summarization
@@ -969,10 +906,6 @@ def text_summarization(text):
     return "RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT RANDOM TEXT"
 
 
-# Perform text summarization using AI
-ai_generated_text = text_summarization(scrapped_text)
-
-
 # Function to get a random image from the assets directory
 def get_random_image_from_assets(directory="assets"):
     images = [
@@ -984,11 +917,12 @@ def get_random_image_from_assets(directory="assets"):
     return random.choice(images)
 
 
-# Function to get a heaviest image from the assets directory
-def get_heaviest_image_from_assets(directory="assets"):
+# Function to get a heaviest image from the assets directory, only among
+# filenames when given
+def get_heaviest_image_from_assets(directory="assets", filenames=None):
     images = [
         f
-        for f in os.listdir(directory)
+        for f in (os.listdir(directory) if filenames is None else filenames)
         if os.path.isfile(os.path.join(directory, f))
         and f.lower().endswith((".png", ".jpg", ".jpeg", ".gif", ".svg"))
     ]
@@ -1009,24 +943,19 @@ def get_heaviest_image_from_assets(directory="assets"):
     return heaviest_image
 
 
-# Extract image URLs from the website
-
-
-global_soup = extract_image_urls_from_website(global_soup)
-
-# Download and move images to the assets folder
-# download_and_move_images(image_urls, save_path="assets")
-
-# Get a random image from the assets directory
-random_image = get_heaviest_image_from_assets()
-
-
-log_info(f"[INFO] Selected random image: {random_image}")
-
-
-# Create the HTML content for the website
-html_content = ""
-if template == "1":
+# Function to build the HTML content of a template "1" site
+def build_template_html(
+    job,
+    header_colors,
+    background_color,
+    header_text_color,
+    ai_generated_text,
+    random_image,
+):
+    title = job.title
+    url = job.url
+    assets_base_url = job.assets_base_url
+    logo_path = job.logo_path
     template_1_flex_container = f"""<div class="flex-container">
                     <div class="text-column">
                         <span class="title">{title}</span>
@@ -1069,7 +998,7 @@ if template == "1":
             justify-content: space-between;
             align-items: center;
             background-color: {background_color[0]} !important;
-            {font_styles[font]}
+            {font_styles[job.font]}
         }}
         header.site-header {{
             box-sizing: border-box;
@@ -1173,7 +1102,7 @@ if template == "1":
                 </div>
             </header>
             <div class="content">
-                {template_1_flex_container if template == "1" else template_2_flex_container}
+                {template_1_flex_container if job.template == "1" else template_2_flex_container}
                 <button class="order-btn">ORDER NOW</button>
             </div>
             <footer class="site-footer">
@@ -1208,14 +1137,172 @@ if template == "1":
     </html>
     """
 
-    add_unique_class_to_body(html_content)
+    return html_content
+
+
+# Main entry point: generate static/<slug>/index.html from the given URL.
+# progress is an optional callback(stage, state) called as pipeline stages
+# (scrape, assets, css, colors, render) start, finish or are skipped.
+# Returns the absolute path of the generated index.html.
+def generate_site(
+    site_url,
+    site_slug,
+    site_title,
+    site_template="0",
+    site_font="DMSans",
+    progress=None,
+):
+    load_dotenv()
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+
+    job = SiteJob(
+        site_url, site_slug, site_title, site_template, site_font, progress
+    )
+    return run_job(job)
+
+
+# Function to run every stage of the pipeline for a job
+def run_job(job):
+    template = job.template
+    job.downloader = Downloader()
+
+    try:
+        job.create_folders()
+
+        job.manifest = (
+            SiteManifest.load(job.site_dir)
+            if site_incremental
+            else SiteManifest(job.site_dir)
+        )
+        job.job_assets = JobAssets(
+            job.assets_dir, job.assets_base_url, manifest=job.manifest
+        )
+        job.image_optimizer = (
+            ImageOptimizer(job.job_assets)
+            if template == "0" and image_optimization_enabled
+            else None
+        )
+
+        # Scrape text from the provided URL
+        report_progress(job, "scrape", "running")
+        capture = None
+        with span("scrape", template=template):
+            if template == "0":
+                scrape_data_from_url(job)
+            elif template == "1":
+                capture = capture_page(job.url)
+                job.downloader.response_store = capture.responses
+                job.scrapped_text = scrape_text_from_url(job, capture)
+                report_progress(job, "css", "skipped")
+        report_progress(job, "scrape", "done")
+
+        if job.reused:
+            for stage in ("assets", "css", "colors", "render"):
+                report_progress(job, stage, "skipped")
+            finish_job(job)
+            log_success("[SUCCESS] Site is up to date!")
+            return job.html_path
+
+        # Call the color extraction function and logo extraction function
+        header_colors = []
+        background_color = []
+        palette_colors = []
+        header_text_color = []
+        if template == "1":
+            report_progress(job, "colors", "running")
+            with span("colors"):
+                header_colors, background_color, palette_colors = (
+                    extract_colors_from_website(capture)
+                )
+                header_text_color = get_header_text_color([header_colors[0]])
+            with span("logo"):
+                extract_logo_src(job, capture)
+
+            # Print the extracted colors
+            log_info("\nExtracted Colors:")
+            log_info(f"Header Colors: {header_colors}")
+            log_info(f"Header Text Color: {header_text_color}")
+            log_info(f"Background Color: {background_color}")
+            log_info(f"Palette of 4 Colors: {palette_colors}")
+            log_info("\n")
+
+            move_logo_to_assets(job)
+            report_progress(job, "colors", "done")
+        else:
+            report_progress(job, "colors", "skipped")
+
+        # Perform text summarization using AI
+        with span("summarize"):
+            ai_generated_text = text_summarization(job.scrapped_text)
+
+        # Extract image URLs from the website, template "0" already
+        # replaced them while rewriting the page
+        report_progress(job, "assets", "running")
+        with span("images"):
+            if template == "1":
+                extract_image_urls_from_website(job, job.soup)
+
+            # Give the images the srcset of the variants converted meanwhile
+            if job.image_optimizer is not None and job.soup is not None:
+                job.image_optimizer.apply(job.soup)
+
+        # Get a random image from the assets directory
+        # Only files of this run, the folder may still hold files of earlier
+        # runs that are removed when the job finishes
+        random_image = get_heaviest_image_from_assets(
+            job.assets_dir, job.manifest.file_names(assets_folder_name)
+        )
+
+        log_info(f"[INFO] Selected random image: {random_image}")
+        report_progress(job, "assets", "done")
+
+        # Create the HTML file with the generated content
+        report_progress(job, "render", "running")
+        with span("render") as render_attributes:
+            if template == "0":
+                html = serialize_html(job.soup)
+            elif template == "1":
+                html = serialize_html(
+                    add_unique_class_to_body(
+                        build_template_html(
+                            job,
+                            header_colors,
+                            background_color,
+                            header_text_color,
+                            ai_generated_text,
+                            random_image,
+                        )
+                    )
+                )
+            # Atomic, the edit endpoints may read the page at any time
+            job.manifest.write(None, html_file_name, html)
+            render_attributes["bytes"] = len(html)
+
+        report_progress(job, "render", "done")
+        finish_job(job)
+        log_success("[SUCCESS] Site created successfully!")
+        return job.html_path
+    finally:
+        job.downloader.close()
+
+
+# Function to save the manifest of a finished job and remove the files of
+# earlier runs the site does not use anymore
+def finish_job(job):
+    with span("cleanup") as cleanup_attributes:
+        job.manifest.save()
+        cleanup_attributes["removed"] = job.manifest.collect_garbage()
+        cleanup_attributes["store_removed"] = (
+            job.job_assets.store.collect_garbage_if_due()
+        )
+    if cleanup_attributes["removed"]:
+        log_info(f"[INFO] Removed {cleanup_attributes['removed']} unused files.")
+
 
-# Create the HTML file with the generated content if template is not '0'
-if template == "0":
-    with open("index.html", "w", encoding="utf-8") as file:
-        file.write(global_soup.prettify())
-elif template == "1":
-    with open(f"{html_file_name}", "w", encoding="utf-8") as html_file:
-        html_file.write(str(soup_with_unique_classes))
+if __name__ == "__main__":
+    # Check if a URL argument is provided in the command line
+    if len(sys.argv) < 6:
+        print("Please provide a URL, slug, title, template and font as command line arguments.")
+        sys.exit(1)
 
-log_success("[SUCCESS] Site created successfully!")
+    generate_site(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5])
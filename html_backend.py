@@ -0,0 +1,57 @@
+import os
+import importlib.util
+from bs4 import BeautifulSoup
+
+# BeautifulSoup tree builders, fastest first, and the module each one needs
+PARSER_BACKENDS = {
+    "lxml": "lxml",
+    "html5lib": "html5lib",
+    "html.parser": None,
+}
+
+# Parser used when none is requested. lxml is faster but libxml2's HTML4
+# parser does not know <source>, <track> and <wbr> are void elements and
+# nests the following siblings inside them, so it is opt-in.
+DEFAULT_BACKEND = "html.parser"
+html_parser_backend = os.environ.get("HTML_PARSER", DEFAULT_BACKEND)
+# Set to 1 to indent the written HTML like prettify() did before, which is
+# several times slower and adds whitespace that can shift inline layouts
+html_prettify = os.environ.get("HTML_PRETTIFY", "0") == "1"
+
+
+def is_backend_available(name):
+    if name not in PARSER_BACKENDS:
+        return False
+    module = PARSER_BACKENDS[name]
+    return module is None or importlib.util.find_spec(module) is not None
+
+
+def available_backends():
+    return [name for name in PARSER_BACKENDS if is_backend_available(name)]
+
+
+# Returns the backend to parse with: the requested one when it is
+# installed, otherwise html.parser which always is
+def resolve_backend(name=None):
+    name = name or html_parser_backend or DEFAULT_BACKEND
+    if is_backend_available(name):
+        return name
+    print(f"[WARNING] HTML parser {name} is not available, falling back")
+    return DEFAULT_BACKEND
+
+
+def parse_html(markup, backend=None):
+    return BeautifulSoup(markup, resolve_backend(backend))
+
+
+# Serializes a parsed document, compact unless pretty (or HTML_PRETTIFY) is set
+def serialize_html(soup, pretty=None):
+    if pretty is None:
+        pretty = html_prettify
+    return soup.prettify() if pretty else soup.decode()
+
+
+# Parses a piece of HTML into the nodes to insert into a document. The
+# html.parser backend is used as it does not wrap fragments in <html><body>.
+def parse_fragment(markup):
+    return list(BeautifulSoup(markup, "html.parser").contents)
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from email.utils import parsedate_to_datetime
+from requests.structures import CaseInsensitiveDict
+from atomic_files import write_atomic
+
+http_cache_dir = os.environ.get(
+    "HTTP_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "http"),
+)
+http_cache_max_mb = int(os.environ.get("HTTP_CACHE_MAX_MB", 512))
+
+CACHEABLE_STATUS_CODES = (200, 203, 300, 301, 308, 404, 410)
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _cache_control(headers):
+    directives = {}
+    for part in headers.get("Cache-Control", "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+
+# A stored response: status, headers and the time it was stored or revalidated
+class CachedResponse:
+    def __init__(self, url, status_code, headers, stored_at, body_path):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.stored_at = stored_at
+        self.body_path = body_path
+
+    def read_body(self):
+        with open(self.body_path, "rb") as file:
+            return file.read()
+
+    # Seconds the response may be served without revalidation (RFC 9111)
+    def freshness_lifetime(self):
+        directives = _cache_control(self.headers)
+        if "no-cache" in directives:
+            return 0
+        for name in ("s-maxage", "max-age"):
+            if name in directives:
+                try:
+                    return int(directives[name])
+                except ValueError:
+                    return 0
+        date = _parse_date(self.headers.get("Date")) or self.stored_at
+        expires = _parse_date(self.headers.get("Expires"))
+        if expires is not None:
+            return max(0, expires - date)
+        # Heuristic freshness: 10% of the time since the last modification
+        last_modified = _parse_date(self.headers.get("Last-Modified"))
+        if last_modified is not None:
+            return max(0, (date - last_modified) / 10)
+        return 0
+
+    def is_fresh(self):
+        try:
+            age = int(self.headers.get("Age", 0))
+        except ValueError:
+            age = 0
+        current_age = age + time.time() - self.stored_at
+        return current_age < self.freshness_lifetime()
+
+    # Headers for a conditional request that revalidates this response
+    def validators(self):
+        headers = {}
+        if self.headers.get("ETag"):
+            headers["If-None-Match"] = self.headers["ETag"]
+        if self.headers.get("Last-Modified"):
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+
+# On-disk HTTP cache shared by every worker process. Each URL is stored as a
+# <sha256>.json metadata file next to a <sha256>.body file; writes go through
+# a temporary file and os.replace so readers never see partial entries.
+# Reads bump the body mtime, and once the cache outgrows max_bytes the least
+# recently used entries are evicted.
+class HttpCache:
+    def __init__(self, root=http_cache_dir, max_bytes=http_cache_max_mb * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._written_since_check = max_bytes
+        self._lock = threading.Lock()
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        folder = os.path.join(self.root, key[:2])
+        return os.path.join(folder, f"{key}.json"), os.path.join(folder, f"{key}.body")
+
+    def get(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            os.utime(body_path)
+        except (OSError, ValueError):
+            return None
+        return CachedResponse(
+            url, meta["status_code"], meta["headers"], meta["stored_at"], body_path
+        )
+
+    def _write_meta(self, meta_path, url, status_code, headers, stored_at):
+        meta = {
+            "url": url,
+            "status_code": status_code,
+            "headers": dict(headers),
+            "stored_at": stored_at,
+        }
+        write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+    # Stores a response unless its status or Cache-Control forbid it
+    def store(self, url, status_code, headers, body):
+        if status_code not in CACHEABLE_STATUS_CODES:
+            return
+        if "no-store" in _cache_control(headers):
+            return
+        meta_path, body_path = self._paths(url)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        write_atomic(body_path, body)
+        self._write_meta(meta_path, url, status_code, headers, time.time())
+        self._maybe_evict(len(body))
+
+    # Merges the headers of a 304 response into the stored entry
+    def refresh(self, cached, headers):
+        merged = CaseInsensitiveDict(cached.headers)
+        merged.update(headers)
+        meta_path, _ = self._paths(cached.url)
+        cached.headers = merged
+        cached.stored_at = time.time()
+        try:
+            self._write_meta(
+                meta_path, cached.url, cached.status_code, merged, cached.stored_at
+            )
+        except OSError:
+            pass
+
+    def _maybe_evict(self, written):
+        with self._lock:
+            self._written_since_check += written
+            # Scanning the whole cache is not free, only do it after a tenth
+            # of the size limit has been written by this process
+            if self._written_since_check < self.max_bytes / 10:
+                return
+            self._written_since_check = 0
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for folder, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.endswith(".body"):
+                    continue
+                body_path = os.path.join(folder, filename)
+                try:
+                    stat = os.stat(body_path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, body_path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+
+        # Evict down to 90% of the limit so that eviction does not run again
+        # on the very next write
+        target = self.max_bytes * 0.9
+        for _, size, body_path in sorted(entries):
+            if total <= target:
+                break
+            for path in (body_path[: -len(".body")] + ".json", body_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+
+_default_cache = None
+
+
+# Function to get the cache instance of this process
+def get_http_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = HttpCache()
+    return _default_cache
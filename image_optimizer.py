@@ -0,0 +1,192 @@
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+from atomic_files import atomic_path
+
+image_optimization_enabled = os.environ.get("IMAGE_OPTIMIZATION_ENABLED", "1") == "1"
+# Widths of the resized variants, images are never scaled up
+image_variant_widths = [
+    int(width)
+    for width in os.environ.get("IMAGE_VARIANT_WIDTHS", "480,960,1600").split(",")
+    if width.strip()
+]
+# Widest variant, wider originals are scaled down to it
+image_max_width = int(os.environ.get("IMAGE_MAX_WIDTH", 1920))
+image_quality = int(os.environ.get("IMAGE_QUALITY", 80))
+# AVIF variants next to the WebP ones, needs a Pillow build with AVIF support
+image_avif_enabled = os.environ.get("IMAGE_AVIF_ENABLED", "0") == "1"
+image_optimizer_workers = int(
+    os.environ.get("IMAGE_OPTIMIZER_WORKERS", max(1, (os.cpu_count() or 2) // 2))
+)
+
+# Formats Pillow decodes that are worth converting. SVGs are vector
+# graphics and GIFs are often animated, both are served as they are.
+OPTIMIZABLE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".webp")
+VARIANT_FORMATS = {"webp": "WEBP", "avif": "AVIF"}
+VARIANT_MIME_TYPES = {"webp": "image/webp", "avif": "image/avif"}
+
+
+def avif_supported():
+    try:
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+    return ".avif" in Image.registered_extensions()
+
+
+# Runs in a pool process: decodes the image once and writes every variant
+# that does not exist yet into output_dir. Returns [(width, format, path)].
+def create_variants(source_path, output_dir, widths, formats, quality, max_width):
+    with Image.open(source_path) as image:
+        if getattr(image, "is_animated", False):
+            return []
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+        target_widths = sorted(
+            {width for width in widths if width < image.width}
+            | {min(image.width, max_width)}
+        )
+        stem = os.path.splitext(os.path.basename(source_path))[0]
+        os.makedirs(output_dir, exist_ok=True)
+
+        variants = []
+        # Largest first, every smaller variant is resized from the previous
+        # one which is cheaper than starting from the original each time
+        resized = image
+        for width in reversed(target_widths):
+            height = max(1, round(image.height * width / image.width))
+            resized = resized.resize((width, height), Image.LANCZOS)
+            for variant_format in formats:
+                path = os.path.join(output_dir, f"{stem}-{width}w.{variant_format}")
+                try:
+                    # Refreshes the age of a reused variant for the store GC
+                    os.utime(path)
+                except FileNotFoundError:
+                    with atomic_path(path) as tmp_path:
+                        resized.save(
+                            tmp_path, VARIANT_FORMATS[variant_format], quality=quality
+                        )
+                variants.append((width, variant_format, path))
+        return sorted(variants)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_image_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=image_optimizer_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+@atexit.register
+def _shutdown_executor():
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Function to get the sizes of a srcset: the width the image was rendered at
+# during capture, or without it the width of its largest variant (its own
+# width, capped at image_max_width). Screens narrower than that show it at
+# most full width.
+def image_sizes(rendered_width, variants):
+    try:
+        width = int(rendered_width)
+    except (TypeError, ValueError):
+        width = 0
+    if width <= 0:
+        width = max(variant_width for variant_width, _, _ in variants)
+    return f"(max-width: {width}px) 100vw, {width}px"
+
+
+# Image optimization stage of one job. submit() queues the conversion of
+# a saved <img> source in the process pool right away, apply() waits for
+# the conversions and gives every image a srcset of its WebP variants
+# (wrapped in a <picture> with an AVIF <source> when AVIF is enabled).
+# Variants live in the asset store next to the originals, named after the
+# content hash, so an image is only converted once across all jobs.
+class ImageOptimizer:
+    def __init__(
+        self,
+        job_assets,
+        widths=None,
+        quality=image_quality,
+        avif=image_avif_enabled,
+        executor=None,
+    ):
+        self.job_assets = job_assets
+        self.widths = widths or image_variant_widths
+        self.quality = quality
+        self.formats = ["webp"] + (["avif"] if avif and avif_supported() else [])
+        self.executor = executor
+        self._pending = []
+        # One conversion per source file, however many <img> tags use it
+        self._futures = {}
+
+    # rendered_width is the width in CSS pixels the image had on the
+    # captured page, when known
+    def submit(self, image_tag, local_url, rendered_width=None):
+        filename = os.path.basename(local_url)
+        if not filename.lower().endswith(OPTIMIZABLE_EXTENSIONS):
+            return
+        source_path = os.path.join(self.job_assets.assets_dir, filename)
+        if not os.path.exists(source_path):
+            return
+        future = self._futures.get(source_path)
+        if future is None:
+            executor = self.executor or get_image_executor()
+            future = executor.submit(
+                create_variants,
+                source_path,
+                os.path.join(self.job_assets.store.root, "variants"),
+                self.widths,
+                self.formats,
+                self.quality,
+                image_max_width,
+            )
+            self._futures[source_path] = future
+        self._pending.append((image_tag, future, rendered_width))
+
+    def apply(self, soup):
+        pending, self._pending = self._pending, []
+        for image_tag, future, rendered_width in pending:
+            try:
+                variants = future.result()
+            except Exception as e:
+                print(f"[ERROR] Failed to optimize image {image_tag.get('src')}: {e}")
+                continue
+            srcsets = {}
+            for width, variant_format, path in variants:
+                srcsets.setdefault(variant_format, []).append(
+                    f"{self.job_assets.link(path)} {width}w"
+                )
+            if "webp" not in srcsets:
+                continue
+            image_tag["srcset"] = ", ".join(srcsets["webp"])
+            image_tag["sizes"] = image_tag.get("sizes") or image_sizes(
+                rendered_width, variants
+            )
+            if "avif" in srcsets and image_tag.parent is not None:
+                picture = image_tag.wrap(soup.new_tag("picture"))
+                picture.insert(
+                    0,
+                    soup.new_tag(
+                        "source",
+                        attrs={
+                            "type": VARIANT_MIME_TYPES["avif"],
+                            "srcset": ", ".join(srcsets["avif"]),
+                            "sizes": image_tag["sizes"],
+                        },
+                    ),
+                )
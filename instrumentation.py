@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# JSON lines file every finished span is appended to, empty to disable
+trace_log_path = os.environ.get(
+    "TRACE_LOG_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "spans.jsonl"),
+)
+
+# Upper bounds in seconds of the duration histogram buckets
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_local = threading.local()
+
+
+# The spans of one generation job. Spans opened with span() in the thread
+# that started the trace nest automatically; other threads (the downloader
+# pool) add theirs with record().
+class Trace:
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+        self._stack = []
+        self._lock = threading.Lock()
+
+    def record(self, name, kind, start, duration, parent=None, **attributes):
+        span = {
+            "trace_id": self.trace_id,
+            "name": name,
+            "kind": kind,
+            "parent": parent,
+            "start": round(start, 6),
+            "duration_ms": round(duration * 1000, 3),
+        }
+        span.update(attributes)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+
+def start_trace(trace_id):
+    trace = Trace(trace_id)
+    _local.trace = trace
+    return trace
+
+
+def end_trace():
+    trace = current_trace()
+    _local.trace = None
+    return trace
+
+
+# Function to get the trace started in this thread, or None
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+# Times the enclosed block as a span of the current trace. Yields a dict
+# that the block can fill with attributes (bytes, counts, ...). Without a
+# trace the block just runs.
+@contextmanager
+def span(name, kind="stage", **attributes):
+    trace = current_trace()
+    if trace is None:
+        yield attributes
+        return
+    parent = trace._stack[-1] if trace._stack else None
+    trace._stack.append(name)
+    start = time.time()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace._stack.pop()
+        if error is not None:
+            attributes["error"] = error
+        trace.record(
+            name, kind, start, time.perf_counter() - started, parent, **attributes
+        )
+
+
+# Fixed bucket histogram in the Prometheus exposition format
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def render(self, name, labels):
+        lines = []
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append(f"{name}_bucket{_labels(labels, le=bound)} {count}")
+        lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {self.count}')
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum:.6f}")
+        lines.append(f"{name}_count{_labels(labels)} {self.count}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra):
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+# Aggregates the spans of finished jobs into Prometheus metrics
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_durations = {}
+        self.fetch_durations = {}
+        self.fetch_bytes = {}
+        self.fetch_retries = 0
+        self.fetch_errors = 0
+        self.jobs = 0
+
+    def observe(self, spans):
+        with self._lock:
+            self.jobs += 1
+            for span in spans:
+                seconds = span["duration_ms"] / 1000
+                if span["kind"] == "asset_fetch":
+                    status = span.get("cache_status") or "error"
+                    self.fetch_durations.setdefault(status, Histogram()).observe(seconds)
+                    self.fetch_bytes[status] = self.fetch_bytes.get(status, 0) + span.get(
+                        "bytes", 0
+                    )
+                    self.fetch_retries += span.get("retries", 0)
+                    if "error" in span:
+                        self.fetch_errors += 1
+                else:
+                    self.stage_durations.setdefault(span["name"], Histogram()).observe(
+                        seconds
+                    )
+
+    def render(self):
+        with self._lock:
+            lines = [
+                "# HELP sitegen_jobs_traced_total Generation jobs whose spans were collected",
+                "# TYPE sitegen_jobs_traced_total counter",
+                f"sitegen_jobs_traced_total {self.jobs}",
+                "# HELP sitegen_stage_duration_seconds Duration of pipeline stages",
+                "# TYPE sitegen_stage_duration_seconds histogram",
+            ]
+            for stage, histogram in sorted(self.stage_durations.items()):
+                lines += histogram.render("sitegen_stage_duration_seconds", {"stage": stage})
+            lines += [
+                "# HELP sitegen_asset_fetch_duration_seconds Duration of asset fetches",
+                "# TYPE sitegen_asset_fetch_duration_seconds histogram",
+            ]
+            for status, histogram in sorted(self.fetch_durations.items()):
+                lines += histogram.render(
+                    "sitegen_asset_fetch_duration_seconds", {"cache_status": status}
+                )
+            lines += [
+                "# HELP sitegen_asset_fetch_bytes_total Bytes of fetched assets",
+                "# TYPE sitegen_asset_fetch_bytes_total counter",
+            ]
+            for status, total in sorted(self.fetch_bytes.items()):
+                lines.append(
+                    f"sitegen_asset_fetch_bytes_total{_labels({'cache_status': status})} {total}"
+                )
+            lines += [
+                "# HELP sitegen_asset_fetch_retries_total Retried asset requests",
+                "# TYPE sitegen_asset_fetch_retries_total counter",
+                f"sitegen_asset_fetch_retries_total {self.fetch_retries}",
+                "# HELP sitegen_asset_fetch_errors_total Failed asset fetches",
+                "# TYPE sitegen_asset_fetch_errors_total counter",
+                f"sitegen_asset_fetch_errors_total {self.fetch_errors}",
+            ]
+            return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+_log_lock = threading.Lock()
+
+
+# Function to publish the spans of a finished job: appended to the JSON
+# lines log and aggregated into the Prometheus metrics
+def export_spans(spans):
+    registry.observe(spans)
+    if not trace_log_path:
+        return
+    try:
+        os.makedirs(os.path.dirname(trace_log_path), exist_ok=True)
+        with _log_lock, open(trace_log_path, "a", encoding="utf-8") as log_file:
+            for span in spans:
+                log_file.write(json.dumps(span) + "\n")
+    except OSError as e:
+        print(f"[ERROR] Failed to write spans: {e}")
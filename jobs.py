@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+from contextlib import contextmanager
+from concurrent.futures.process import BrokenProcessPool
+import worker_pool
+
+STAGES = ["scrape", "assets", "css", "colors", "render"]
+
+max_pending_jobs = int(os.environ.get("MAX_PENDING_JOBS", 20))
+job_retention_seconds = int(os.environ.get("JOB_RETENTION_SECONDS", 3600))
+# SQLite file holding the jobs, shared by every server process (gunicorn
+# workers) so any of them can answer for a job and the pending limit is global
+job_store_path = os.environ.get(
+    "JOB_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "jobs.sqlite3"),
+)
+
+JOB_COLUMNS = (
+    "id",
+    "slug",
+    "params",
+    "status",
+    "stages",
+    "error",
+    "result_path",
+    "created_at",
+    "started_at",
+    "finished_at",
+)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, slug, params):
+        self.id = str(uuid.uuid4())
+        self.slug = slug
+        self.params = params
+        self.status = "queued"
+        self.stages = {stage: "pending" for stage in STAGES}
+        self.error = None
+        self.result_path = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @classmethod
+    def from_row(cls, row):
+        job = cls.__new__(cls)
+        for column, value in zip(JOB_COLUMNS, row):
+            setattr(job, column, value)
+        job.params = json.loads(job.params)
+        job.stages = json.loads(job.stages)
+        return job
+
+    def to_row(self):
+        row = {column: getattr(self, column) for column in JOB_COLUMNS}
+        row["params"] = json.dumps(self.params)
+        row["stages"] = json.dumps(self.stages)
+        return tuple(row[column] for column in JOB_COLUMNS)
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "slug": self.slug,
+            "status": self.status,
+            "stages": dict(self.stages),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+# Jobs kept in a SQLite file. Every change runs in its own write
+# transaction, so concurrent server processes never lose an update.
+class JobStore:
+    def __init__(self, path=job_store_path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, slug TEXT, params TEXT, status TEXT, "
+                "stages TEXT, error TEXT, result_path TEXT, created_at REAL, "
+                "started_at REAL, finished_at REAL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # Connections are not shared between threads, progress and results
+        # arrive on threads of their own
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    # Yields a connection inside a write transaction, committed when the
+    # block is done and rolled back when it fails
+    @contextmanager
+    def transaction(self):
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def get(self, job_id, connection=None):
+        if connection is None:
+            with self._connect() as connection:
+                return self.get(job_id, connection)
+        row = connection.execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return Job.from_row(row) if row else None
+
+    def put(self, job, connection):
+        connection.execute(
+            f"INSERT OR REPLACE INTO jobs ({', '.join(JOB_COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in JOB_COLUMNS)})",
+            job.to_row(),
+        )
+
+    def pending_count(self, connection=None):
+        if connection is None:
+            with self._connect() as connection:
+                return self.pending_count(connection)
+        return connection.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()[0]
+
+    # Forget finished jobs older than the retention window. A job still
+    # pending after it is the job of a server process that stopped, it is
+    # marked as failed so it no longer counts against the pending limit.
+    def prune(self, retention, connection):
+        expire_before = time.time() - retention
+        connection.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (expire_before,),
+        )
+        connection.execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, "
+            "error = 'The server process running the job stopped' "
+            "WHERE status IN ('queued', 'running') AND created_at < ?",
+            (time.time(), expire_before),
+        )
+
+
+# Keeps track of site generation jobs running on the worker pool.
+# At most max_pending jobs may be queued or running at the same time,
+# submit() raises QueueFullError beyond that so callers can shed load.
+# Jobs live in a JobStore shared by all server processes: any of them
+# answers for a job, and the limit holds across all of them. Progress and
+# results are only recorded by the process that submitted the job.
+class JobManager:
+    def __init__(
+        self,
+        max_pending=max_pending_jobs,
+        retention=job_retention_seconds,
+        store=None,
+    ):
+        self.max_pending = max_pending
+        self.retention = retention
+        self.store = store or JobStore()
+        worker_pool.set_progress_listener(self._on_progress)
+
+    def pending_count(self):
+        return self.store.pending_count()
+
+    def submit(self, url, slug, title, template, font):
+        job = Job(slug, {"url": url, "title": title, "template": template, "font": font})
+        with self.store.transaction() as connection:
+            self.store.prune(self.retention, connection)
+            pending = self.store.pending_count(connection)
+            if pending >= self.max_pending:
+                raise QueueFullError(
+                    f"Too many pending jobs ({pending}/{self.max_pending}), retry later"
+                )
+            self.store.put(job, connection)
+
+        try:
+            future = worker_pool.submit_generation(
+                url, slug, title, template, font, job_id=job.id
+            )
+        except Exception as e:
+            self._finish(job.id, error=str(e))
+            raise
+        future.add_done_callback(lambda f: self._on_done(job.id, f))
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def _on_progress(self, job_id, stage, state):
+        with self.store.transaction() as connection:
+            job = self.store.get(job_id, connection)
+            if job is None:
+                return
+            if job.finished:
+                # Progress travels apart from the result and may arrive after
+                # it, only a late "skipped" still tells something new
+                if job.status == "done" and state == "skipped":
+                    job.stages[stage] = state
+                    self.store.put(job, connection)
+                return
+            if job.status == "queued":
+                job.status = "running"
+                job.started_at = time.time()
+            job.stages[stage] = state
+            self.store.put(job, connection)
+
+    def _on_done(self, job_id, future):
+        try:
+            self._finish(job_id, result_path=future.result())
+        except BrokenProcessPool as e:
+            worker_pool.reset_executor(future.executor)
+            self._finish(job_id, error=f"Generation worker crashed: {e}")
+        except Exception as e:
+            self._finish(job_id, error=str(e))
+
+    def _finish(self, job_id, result_path=None, error=None):
+        with self.store.transaction() as connection:
+            job = self.store.get(job_id, connection)
+            if job is None:
+                return
+            job.finished_at = time.time()
+            job.result_path = result_path
+            job.error = error
+            job.status = "failed" if error else "done"
+            for stage, state in job.stages.items():
+                if error:
+                    if state == "running":
+                        job.stages[stage] = "failed"
+                elif state != "skipped":
+                    # The result may come back before the last progress
+                    # messages, every stage of a finished job ran
+                    job.stages[stage] = "done"
+            self.store.put(job, connection)
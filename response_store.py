@@ -0,0 +1,99 @@
+import os
+import threading
+from urllib.parse import urldefrag
+from requests.structures import CaseInsensitiveDict
+
+# Largest response body kept in memory per asset
+max_recorded_bytes = int(os.environ.get("MAX_RECORDED_MB", 15)) * 1024 * 1024
+
+# Responses the generated site reuses, their bodies get recorded
+RECORDED_RESOURCE_TYPES = ("stylesheet", "script", "font", "image")
+
+
+# A response the browser received while the page was captured
+class RecordedResponse:
+    def __init__(self, url, status_code, headers, body, resource_type):
+        self.url = url
+        self.status_code = status_code
+        # Playwright gives lower-cased names, lookups must not depend on case
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.body = body
+        self.resource_type = resource_type
+
+
+# Bodies of the assets the browser downloaded during capture, keyed by URL,
+# so that later stages can use them instead of downloading them again.
+# Responses are recorded by the RequestRouter as they pass through it, and
+# attach() catches the ones that never hit the router (for example those
+# answered by a service worker).
+class ResponseStore:
+    def __init__(
+        self,
+        max_body_bytes=max_recorded_bytes,
+        record_resource_types=RECORDED_RESOURCE_TYPES,
+    ):
+        self.max_body_bytes = max_body_bytes
+        self.record_resource_types = set(record_resource_types)
+        self.total_bytes = 0
+        self._responses = {}
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._responses)
+
+    def __contains__(self, url):
+        return urldefrag(url)[0] in self._responses
+
+    def should_record(self, resource_type):
+        return resource_type in self.record_resource_types
+
+    def record(self, url, status_code, headers, body, resource_type):
+        if not 200 <= status_code < 300 or len(body) > self.max_body_bytes:
+            return False
+        key = urldefrag(url)[0]
+        with self._lock:
+            if key in self._responses:
+                return False
+            self._responses[key] = RecordedResponse(
+                url, status_code, headers, body, resource_type
+            )
+            self.total_bytes += len(body)
+        return True
+
+    # Every RecordedResponse, in no particular order
+    def responses(self):
+        with self._lock:
+            return list(self._responses.values())
+
+    # Returns the RecordedResponse for url, or None if the browser never got it
+    def get(self, url):
+        with self._lock:
+            return self._responses.get(urldefrag(url)[0])
+
+    def attach(self, page):
+        page.on("response", self._on_response)
+
+    def _on_response(self, response):
+        # Bodies are read in flush(), reading them inside the event handler
+        # would block the page while it is still loading
+        if self.should_record(response.request.resource_type) and response.url not in self:
+            self._pending.append(response)
+
+    # Reads the bodies of responses seen by attach(), call before the page closes
+    def flush(self):
+        pending, self._pending = self._pending, []
+        for response in pending:
+            if response.url in self:
+                continue
+            try:
+                body = response.body()
+            except Exception:
+                continue
+            self.record(
+                response.url,
+                response.status,
+                response.headers,
+                body,
+                response.request.resource_type,
+            )
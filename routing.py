@@ -0,0 +1,73 @@
+import os
+from urllib.parse import urlparse
+from constants import BLOCKED_DOMAINS, BLOCKED_RESOURCE_TYPES
+from response_store import ResponseStore
+
+request_blocking_enabled = os.environ.get("REQUEST_BLOCKING_ENABLED", "1") == "1"
+# Comma separated hosts blocked on top of constants.BLOCKED_DOMAINS
+extra_blocked_domains = [
+    domain.strip().lower()
+    for domain in os.environ.get("EXTRA_BLOCKED_DOMAINS", "").split(",")
+    if domain.strip()
+]
+
+
+# Routing layer installed on a BrowserContext. It aborts requests to blocked
+# hosts and of blocked resource types, and fetches the stylesheets, scripts,
+# fonts and images itself so their bodies are recorded into the
+# ResponseStore on the way through.
+class RequestRouter:
+    def __init__(self, blocked_domains=None, blocked_resource_types=None, store=None):
+        if blocked_domains is None:
+            blocked_domains = BLOCKED_DOMAINS + extra_blocked_domains
+        if blocked_resource_types is None:
+            blocked_resource_types = BLOCKED_RESOURCE_TYPES
+        self.blocked_domains = tuple(domain.lower() for domain in blocked_domains)
+        self.blocked_resource_types = set(blocked_resource_types)
+        self.store = store if store is not None else ResponseStore()
+        self.stats = {"blocked": 0, "recorded": 0, "passed": 0, "fetch_failed": 0}
+
+    def install(self, context):
+        context.route("**/*", self._handle)
+
+    def is_blocked(self, request):
+        if request.resource_type in self.blocked_resource_types:
+            return True
+        host = (urlparse(request.url).hostname or "").lower()
+        return any(
+            host == domain or host.endswith("." + domain)
+            for domain in self.blocked_domains
+        )
+
+    def _handle(self, route):
+        request = route.request
+        if self.is_blocked(request):
+            self.stats["blocked"] += 1
+            route.abort("blockedbyclient")
+            return
+
+        if (
+            request.method != "GET"
+            or not self.store.should_record(request.resource_type)
+            or request.url in self.store
+        ):
+            self.stats["passed"] += 1
+            route.continue_()
+            return
+
+        try:
+            response = route.fetch()
+            body = response.body()
+        except Exception as e:
+            # Recording must never change what the page loads: let the
+            # browser load the resource itself, it is just not recorded
+            print(f"[ERROR] Failed to record {request.url}: {e}")
+            self.stats["fetch_failed"] += 1
+            route.continue_()
+            return
+
+        if self.store.record(
+            request.url, response.status, response.headers, body, request.resource_type
+        ):
+            self.stats["recorded"] += 1
+        route.fulfill(response=response, body=body)
@@ -0,0 +1,130 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from atomic_files import write_atomic
+from html_backend import parse_html, serialize_html
+
+sites_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# Parsed documents kept in memory between edits
+site_editor_cache_size = int(os.environ.get("SITE_EDITOR_CACHE_SIZE", 16))
+
+HTML_FILE_NAME = "index.html"
+
+
+# Edit request that can not be applied to the document, answered with a 400
+class EditError(ValueError):
+    pass
+
+
+# Function to get the path of the index.html of a generated site
+def site_html_path(slug):
+    if (
+        not isinstance(slug, str)
+        or slug in ("", ".", "..")
+        or "/" in slug
+        or os.sep in slug
+    ):
+        raise EditError(f"Invalid slug: {slug!r}")
+    return os.path.join(sites_dir, slug, HTML_FILE_NAME)
+
+
+# A parsed index.html and the stat of the file it was parsed from, edits of
+# the same document are serialized by its lock
+class CachedDocument:
+    def __init__(self, path):
+        self.path = path
+        self.soup = None
+        self.signature = None
+        self.lock = threading.Lock()
+        # Requests holding or waiting for the lock, see DocumentCache
+        self.users = 0
+
+    def _stat_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def is_current(self):
+        return self.soup is not None and self._stat_signature() == self.signature
+
+    def load(self):
+        with open(self.path, "r", encoding="utf-8") as file:
+            stat = os.fstat(file.fileno())
+            self.soup = parse_html(file.read())
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+
+    def write(self):
+        write_atomic(self.path, serialize_html(self.soup))
+        self.signature = self._stat_signature()
+
+
+# Least recently used cache of the parsed sites. A document is parsed once
+# and edited in memory; it is parsed again only when the file changed on
+# disk (a new generation of the slug). Every edit is written back with an
+# atomic replace, so readers never see a half written index.html.
+# Documents checked out by a request are never evicted: a new entry for the
+# same path would come with a new lock and let two edits of the file race.
+class DocumentCache:
+    def __init__(self, max_size=site_editor_cache_size):
+        self.max_size = max_size
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Evicts the least recently used documents nobody holds, the cache may
+    # stay above max_size while every document is in use. Needs self._lock.
+    def _evict(self):
+        for path in list(self._documents):
+            if len(self._documents) <= self.max_size:
+                break
+            if self._documents[path].users == 0:
+                del self._documents[path]
+
+    # Yields the document at path with its lock held
+    @contextmanager
+    def _checkout(self, path):
+        with self._lock:
+            document = self._documents.get(path)
+            if document is None:
+                document = CachedDocument(path)
+                self._documents[path] = document
+            self._documents.move_to_end(path)
+            document.users += 1
+            self._evict()
+        try:
+            with document.lock:
+                yield document
+        finally:
+            with self._lock:
+                document.users -= 1
+                self._evict()
+
+    # Yields the parsed document at path for editing and writes it back once
+    # the block is done. A failed edit may have left the tree half changed,
+    # it is parsed again from the file, which stays as it was.
+    @contextmanager
+    def edit(self, path):
+        with self._checkout(path) as document:
+            if not document.is_current():
+                document.load()
+            try:
+                yield document.soup
+                document.write()
+            except BaseException:
+                document.soup = None
+                raise
+
+    # Replaces the document at path with soup and writes it
+    def store(self, path, soup):
+        with self._checkout(path) as document:
+            document.soup = soup
+            try:
+                document.write()
+            except BaseException:
+                document.soup = None
+                raise
+
+
+document_cache = DocumentCache()
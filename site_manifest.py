@@ -0,0 +1,156 @@
+import os
+import json
+import hashlib
+import threading
+from atomic_files import write_atomic
+
+# Reuse the files of the previous generation of a slug. With 0 every run
+# rewrites the site from scratch (orphaned files are still removed).
+site_incremental = os.environ.get("SITE_INCREMENTAL", "1") == "1"
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# Folders of a site whose files belong to the manifest, anything in them
+# the last run did not write or reuse is removed
+MANAGED_FOLDERS = ("assets", "css", "js", "fonts")
+
+
+def content_hash(content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+# Function to hash the content of a file, None when it can not be read
+def file_hash(path):
+    try:
+        with open(path, "rb") as file:
+            return content_hash(file.read())
+    except OSError:
+        return None
+
+
+# Function to hash the inputs of a generation, equal fingerprints give the
+# same site
+def fingerprint(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+# The files of one generated site, kept in static/<slug>/manifest.json:
+# every source URL with the content hash and local path of its copy, the
+# hash of every file, and the fingerprint of the page it was built from.
+# A rerun loads the manifest of the previous run, skips writing files
+# whose content did not change, and removes the files nothing uses anymore.
+class SiteManifest:
+    def __init__(self, site_dir, previous=None):
+        self.site_dir = site_dir
+        self.previous = previous or {}
+        self.fingerprint = None
+        # source URL -> {"hash": ..., "path": ...}
+        self.assets = {}
+        # path relative to site_dir -> content hash, None when not hashed
+        self.files = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, site_dir):
+        path = os.path.join(site_dir, MANIFEST_NAME)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                previous = json.load(file)
+        except (OSError, ValueError):
+            return cls(site_dir)
+        if previous.get("version") != MANIFEST_VERSION:
+            return cls(site_dir)
+        return cls(site_dir, previous)
+
+    # Tells whether the file at relative_path is there, with the content of
+    # digest when one was recorded
+    def _is_intact(self, relative_path, digest):
+        path = os.path.join(self.site_dir, relative_path)
+        if digest is None:
+            return os.path.isfile(path)
+        return file_hash(path) == digest
+
+    # Tells whether the previous run was built from the same fingerprint and
+    # all of its files are still there unchanged (not edited or truncated)
+    def is_current(self):
+        if not self.fingerprint or self.previous.get("fingerprint") != self.fingerprint:
+            return False
+        return all(
+            self._is_intact(path, digest)
+            for path, digest in self.previous.get("files", {}).items()
+        )
+
+    # Keeps every file of the previous run, for a run that reuses its output
+    def reuse_previous(self):
+        with self._lock:
+            self.assets.update(self.previous.get("assets", {}))
+            self.files.update(self.previous.get("files", {}))
+
+    # Records a file written or reused by this run, and the URL it came from
+    def record(self, source_url, relative_path, digest=None):
+        with self._lock:
+            self.files[relative_path] = digest
+            if source_url:
+                self.assets[source_url] = {"hash": digest, "path": relative_path}
+
+    # Writes content to relative_path unless the file there already has the
+    # same content, returns the absolute path
+    def write(self, source_url, relative_path, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        digest = content_hash(content)
+        path = os.path.join(self.site_dir, relative_path)
+        previous_digest = self.previous.get("files", {}).get(relative_path)
+        if previous_digest != digest or file_hash(path) != digest:
+            write_atomic(path, content)
+        self.record(source_url, relative_path, digest)
+        return path
+
+    # Names of the files this run recorded in a folder of the site
+    def file_names(self, folder):
+        prefix = folder + "/"
+        with self._lock:
+            return [
+                path[len(prefix) :]
+                for path in self.files
+                if path.startswith(prefix) and "/" not in path[len(prefix) :]
+            ]
+
+    def save(self):
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "fingerprint": self.fingerprint,
+            "assets": self.assets,
+            "files": self.files,
+        }
+        write_atomic(
+            os.path.join(self.site_dir, MANIFEST_NAME),
+            json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8"),
+        )
+
+    # Function to remove the files of the managed folders this run did not
+    # record, returns their number
+    def collect_garbage(self):
+        removed = 0
+        for folder in MANAGED_FOLDERS:
+            folder_path = os.path.join(self.site_dir, folder)
+            for root, _, filenames in os.walk(folder_path):
+                for filename in filenames:
+                    path = os.path.join(root, filename)
+                    relative_path = os.path.relpath(path, self.site_dir).replace(
+                        os.sep, "/"
+                    )
+                    if relative_path in self.files:
+                        continue
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError:
+                        pass
+        return removed
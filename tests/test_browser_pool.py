@@ -0,0 +1,53 @@
+import os
+import queue
+import pytest
+
+browser_pool = pytest.importorskip("browser_pool")
+import worker_pool  # noqa: E402
+
+
+class FakeContext:
+    def close(self):
+        pass
+
+
+class FakeBrowser:
+    def is_connected(self):
+        return True
+
+    def new_context(self, **options):
+        return FakeContext()
+
+    def new_browser_cdp_session(self):
+        raise RuntimeError("no CDP in tests")
+
+    def close(self):
+        pass
+
+
+# The snapshot a worker reports while its job holds a browser counts that
+# browser as in use, /metrics/browser_pool reads these snapshots
+def test_running_job_reports_saturation(monkeypatch):
+    pool = browser_pool.get_browser_pool()
+    monkeypatch.setattr(
+        pool,
+        "_launch",
+        lambda temporary=False: browser_pool.PooledBrowser(FakeBrowser(), temporary),
+    )
+    progress_queue = queue.Queue()
+    monkeypatch.setattr(worker_pool, "_worker_progress_queue", progress_queue)
+    browser_pool.set_metrics_listener(worker_pool._publish_browser_metrics)
+    try:
+        with pool.new_context():
+            progress_queue.put(None)
+            worker_pool._drain_progress(progress_queue)
+            running = worker_pool.get_worker_metrics()[os.getpid()]["browser_pool"]
+            assert running["in_use"] == 1
+            assert running["saturation"] > 0
+        progress_queue.put(None)
+        worker_pool._drain_progress(progress_queue)
+        released = worker_pool.get_worker_metrics()[os.getpid()]["browser_pool"]
+        assert released["in_use"] == 0
+        assert released["peak_in_use"] >= 1
+    finally:
+        browser_pool.set_metrics_listener(None)
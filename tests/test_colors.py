@@ -0,0 +1,28 @@
+import numpy as np
+from PIL import Image
+from colors import extract_palettes
+
+
+def _distance(a, b):
+    return np.abs(np.asarray(a, dtype=int) - np.asarray(b, dtype=int)).max()
+
+
+# A white page with a thin blue header and a red and a green block, the
+# white carries some anti-aliasing noise like text on a real page
+def _page():
+    page = np.full((400, 400, 3), 255, np.uint8)
+    page[:20] = (30, 60, 200)
+    page[100:180, 40:160] = (200, 32, 32)
+    page[220:300, 220:360] = (32, 175, 59)
+    noise = np.random.default_rng(0).random((400, 400)) < 0.03
+    page[noise & (page.sum(axis=2) == 765)] = (250, 246, 246)
+    return Image.fromarray(page)
+
+
+def test_small_distinct_color_survives():
+    header, background, palette = extract_palettes(_page())
+    for color in [(255, 255, 255), (30, 60, 200), (200, 32, 32), (32, 175, 59)]:
+        assert min(_distance(color, center) for center in palette) <= 8, palette
+    assert _distance(background, (255, 255, 255)) <= 40
+    assert _distance(palette[0], (255, 255, 255)) <= 8
+    assert any(_distance(center, (30, 60, 200)) <= 8 for center in header)
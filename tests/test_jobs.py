@@ -0,0 +1,36 @@
+import os
+import pytest
+from concurrent.futures import Future
+import jobs
+import worker_pool
+
+
+# Two managers on the same store stand for two server processes
+def test_jobs_are_shared_between_processes(tmp_path, monkeypatch):
+    futures = []
+
+    def submit_generation(*args, job_id=None):
+        future = Future()
+        futures.append(future)
+        return future
+
+    monkeypatch.setattr(worker_pool, "submit_generation", submit_generation)
+    path = os.path.join(str(tmp_path), "jobs.sqlite3")
+    first = jobs.JobManager(max_pending=2, store=jobs.JobStore(path))
+    second = jobs.JobManager(max_pending=2, store=jobs.JobStore(path))
+
+    job = first.submit("https://example.com", "example", "Example", "0", "0")
+    assert second.get(job.id).status == "queued"
+
+    first._on_progress(job.id, "scrape", "running")
+    assert second.get(job.id).to_dict()["stages"]["scrape"] == "running"
+
+    second.submit("https://example.com", "other", "Other", "0", "0")
+    with pytest.raises(jobs.QueueFullError):
+        first.submit("https://example.com", "third", "Third", "0", "0")
+
+    futures[0].set_result("/site/index.html")
+    finished = second.get(job.id)
+    assert finished.status == "done"
+    assert set(finished.stages.values()) == {"done"}
+    assert first.pending_count() == 1
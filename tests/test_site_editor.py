@@ -0,0 +1,49 @@
+import os
+import threading
+from site_editor import DocumentCache
+from site_manifest import SiteManifest
+
+
+def _page(label):
+    rows = "".join(f"<p>{label} {index}</p>" for index in range(2000))
+    return f'<html><body>{rows}<div class="end unique-class-1">end</div></body></html>'
+
+
+# Generation writes index.html through the manifest while the editor loads,
+# edits and writes it back: neither may ever see or leave a partial page
+def test_generation_and_edit_never_truncate_the_page(tmp_path):
+    site_dir = str(tmp_path)
+    html_path = os.path.join(site_dir, "index.html")
+    SiteManifest(site_dir).write(None, "index.html", _page("first"))
+    cache = DocumentCache()
+    errors = []
+
+    def generate():
+        try:
+            for run in range(30):
+                SiteManifest(site_dir).write(None, "index.html", _page(f"run {run}"))
+        except Exception as e:
+            errors.append(e)
+
+    def edit():
+        try:
+            for run in range(30):
+                with cache.edit(html_path) as soup:
+                    end = soup.find(class_="end")
+                    assert end is not None, "edited a truncated page"
+                    end.string = f"edit {run}"
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=generate), threading.Thread(target=edit)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors, errors
+    with open(html_path, encoding="utf-8") as file:
+        html = file.read()
+    assert html.rstrip().endswith("</html>")
+    assert 'class="end unique-class-1"' in html
+    assert not [name for name in os.listdir(site_dir) if name.endswith(".tmp")]
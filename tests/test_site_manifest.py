@@ -0,0 +1,33 @@
+import os
+from site_manifest import SiteManifest
+
+
+def _generate(site_dir, html):
+    manifest = SiteManifest.load(site_dir)
+    manifest.fingerprint = "page"
+    current = manifest.is_current()
+    if current:
+        manifest.reuse_previous()
+    else:
+        manifest.write(None, "index.html", html)
+    manifest.save()
+    return current
+
+
+def test_edited_or_truncated_page_is_not_current(tmp_path):
+    site_dir = str(tmp_path)
+    html_path = os.path.join(site_dir, "index.html")
+    assert not _generate(site_dir, "<html><body>generated</body></html>")
+    assert _generate(site_dir, "<html><body>generated</body></html>")
+
+    with open(html_path, "w", encoding="utf-8") as file:
+        file.write("<html><body>edited</body></html>")
+    assert not _generate(site_dir, "<html><body>generated</body></html>")
+    with open(html_path, encoding="utf-8") as file:
+        assert file.read() == "<html><body>generated</body></html>"
+
+    with open(html_path, "w", encoding="utf-8") as file:
+        file.write("<html><bo")
+    assert not _generate(site_dir, "<html><body>generated</body></html>")
+    with open(html_path, encoding="utf-8") as file:
+        assert file.read() == "<html><body>generated</body></html>"
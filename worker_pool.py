@@ -0,0 +1,156 @@
+import os
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import instrumentation
+
+generation_workers = int(os.environ.get("GENERATION_WORKERS", 2))
+
+_executor = None
+_executor_lock = threading.Lock()
+_progress_queue = None
+_progress_listener = None
+_worker_progress_queue = None
+_worker_metrics = {}
+_worker_metrics_lock = threading.Lock()
+
+
+# Runs once in every worker process: pay for the heavy imports up front
+def _init_worker(progress_queue):
+    global _worker_progress_queue
+    _worker_progress_queue = progress_queue
+
+    import generate_site  # noqa: F401
+    import browser_pool
+
+    browser_pool.set_metrics_listener(_publish_browser_metrics)
+
+
+# Sends the browser pool metrics of this worker to the parent, called by the
+# pool while a job holds its browser and once it is released
+def _publish_browser_metrics(snapshot):
+    _worker_progress_queue.put(("metrics", os.getpid(), "browser_pool", snapshot))
+
+
+# Runs a single site generation inside a warm worker process
+def _run_generation(job_id, url, slug, title, template, font):
+    import generate_site
+
+    progress = None
+    if job_id is not None:
+
+        def progress(stage, state):
+            _worker_progress_queue.put(("progress", job_id, stage, state))
+
+    trace = instrumentation.start_trace(job_id or uuid.uuid4().hex)
+    try:
+        with instrumentation.span("generate_site", slug=slug, template=template):
+            return generate_site.generate_site(
+                url, slug, title, template, font, progress
+            )
+    finally:
+        instrumentation.end_trace()
+        _worker_progress_queue.put(("spans", trace.spans))
+
+
+def _ping():
+    return os.getpid()
+
+
+# Forwards stage progress sent by the workers to the registered listener,
+# exports the spans of finished jobs and keeps the latest metrics snapshot
+# reported by every worker
+def _drain_progress(progress_queue):
+    while True:
+        message = progress_queue.get()
+        if message is None:
+            return
+        kind, *payload = message
+        if kind == "metrics":
+            pid, name, snapshot = payload
+            with _worker_metrics_lock:
+                _worker_metrics.setdefault(pid, {})[name] = snapshot
+            continue
+        if kind == "spans":
+            instrumentation.export_spans(*payload)
+            continue
+        listener = _progress_listener
+        if listener is not None:
+            try:
+                listener(*payload)
+            except Exception as e:
+                print(f"[ERROR] Progress listener failed: {e}")
+
+
+# Function to get the latest metrics snapshots keyed by worker pid
+def get_worker_metrics():
+    with _worker_metrics_lock:
+        return {pid: dict(metrics) for pid, metrics in _worker_metrics.items()}
+
+
+# Function to register a callback(job_id, stage, state) for worker progress
+def set_progress_listener(listener):
+    global _progress_listener
+    _progress_listener = listener
+
+
+# Function to get the shared pool of long-lived generation workers
+def get_executor():
+    global _executor, _progress_queue
+    with _executor_lock:
+        if _executor is None:
+            mp_context = multiprocessing.get_context("spawn")
+            _progress_queue = mp_context.Queue()
+            threading.Thread(
+                target=_drain_progress, args=(_progress_queue,), daemon=True
+            ).start()
+            _executor = ProcessPoolExecutor(
+                max_workers=generation_workers,
+                mp_context=mp_context,
+                initializer=_init_worker,
+                initargs=(_progress_queue,),
+            )
+        return _executor
+
+
+# Function to drop a broken pool so that the next job starts fresh workers.
+# broken is the pool that failed: every job in flight on it reports the
+# failure, only the first report replaces it and the jobs already running
+# on its replacement are left alone.
+def reset_executor(broken):
+    global _executor, _progress_queue
+    with _executor_lock:
+        if broken is None or _executor is not broken:
+            return
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        if _progress_queue is not None:
+            _progress_queue.put(None)
+        _executor = None
+        _progress_queue = None
+
+
+# Function to start every worker ahead of the first request
+def warm_up():
+    executor = get_executor()
+    futures = [executor.submit(_ping) for _ in range(generation_workers)]
+    return [future.result() for future in futures]
+
+
+# Function to queue a site generation on the worker pool, returns a Future.
+# When job_id is given, stage progress is forwarded to the progress listener.
+# The future's executor attribute is the pool it runs on, to pass to
+# reset_executor() when it fails with BrokenProcessPool.
+def submit_generation(url, slug, title, template, font, job_id=None):
+    args = (job_id, url, slug, title, template, font)
+    executor = get_executor()
+    try:
+        future = executor.submit(_run_generation, *args)
+    except BrokenProcessPool:
+        reset_executor(executor)
+        executor = get_executor()
+        future = executor.submit(_run_generation, *args)
+    future.executor = executor
+    return future